@@ -1,3 +1,5 @@
+import math
+
 import streamlit as st
 from st_aggrid import (
     AgGrid,
@@ -7,6 +9,8 @@ from st_aggrid import (
     GridOptionsBuilder,
 )
 
+from db_operator import count_rows, read_page
+
 # JS方法，用于增加一行到AgGrid表格
 js_add_row = JsCode(
     """
@@ -58,7 +62,7 @@ cellRenderer_addButton = JsCode(
 
 
 # 定义动态表格，并返回操作数据
-def aggrid_question(question_df):
+def aggrid_question(question_df, paginate=True):
     if question_df.empty:
         # 创建一个空容器，用于占位
         container = st.container()
@@ -110,6 +114,9 @@ def aggrid_question(question_df):
             header_name="添加时间",
             width=100,
         )
+        # 评分用的辅助列不显示
+        gd.configure_column(field="normalized_answer", hide=True)
+        gd.configure_column(field="ordinal", hide=True)
         gd.configure_column(
             field="🌟",
             onCellClicked=js_add_row,
@@ -126,13 +133,14 @@ def aggrid_question(question_df):
         )
         # 表格右侧工具栏
         # gd.configure_side_bar()
-        # 分页
-        gd.configure_pagination(
-            # 取消自动分页
-            paginationAutoPageSize=False,
-            # 30页一分页
-            paginationPageSize=30,
-        )
+        # 分页（数据已在数据库中分页时不再由表格分页）
+        if paginate:
+            gd.configure_pagination(
+                # 取消自动分页
+                paginationAutoPageSize=False,
+                # 30页一分页
+                paginationPageSize=30,
+            )
 
         gridoptions = gd.build()
 
@@ -152,7 +160,7 @@ def aggrid_question(question_df):
 
 
 # 定义动态表格，并返回操作数据
-def aggrid_student(student_df):
+def aggrid_student(student_df, paginate=True):
     if student_df.empty:
         # 创建一个空容器，用于占位
         container = st.container()
@@ -205,13 +213,14 @@ def aggrid_student(student_df):
         )
         # 表格右侧工具栏
         # gd.configure_side_bar()
-        # 分页
-        gd.configure_pagination(
-            # 取消自动分页
-            paginationAutoPageSize=False,
-            # 30页一分页
-            paginationPageSize=30,
-        )
+        # 分页（数据已在数据库中分页时不再由表格分页）
+        if paginate:
+            gd.configure_pagination(
+                # 取消自动分页
+                paginationAutoPageSize=False,
+                # 30页一分页
+                paginationPageSize=30,
+            )
 
         gridoptions = gd.build()
 
@@ -227,4 +236,69 @@ def aggrid_student(student_df):
             # streamlit,alpine,balham,material
         )
         # 返回数据
-        return grid_res
\ No newline at end of file
+        return grid_res
+
+
+# 键集分页显示数据表：每次只从数据库读取当前页，并只把这一页发送给表格
+def aggrid_paged(table_name, grid_func, page_size=30, sort_columns=None):
+    """sort_columns为{列名: 显示名称}，第一个为默认排序；返回表格的操作数据"""
+    state_key = f"{table_name}_pager"
+    if state_key not in st.session_state:
+        # cursors保存每一页的起始游标，第一页为None
+        st.session_state[state_key] = {"cursors": [None], "sort": None}
+    pager = st.session_state[state_key]
+
+    # 排序设置
+    sort_key = None
+    descending = False
+    if sort_columns:
+        col1, col2 = st.columns([3, 1])
+        with col1:
+            sort_key = st.selectbox(
+                "排序",
+                list(sort_columns),
+                format_func=lambda column: sort_columns[column],
+                key=f"{state_key}_sort_key",
+            )
+        with col2:
+            descending = st.checkbox("倒序", key=f"{state_key}_descending")
+        # id本身就是默认的分页键
+        if sort_key == "id":
+            sort_key = None
+    # 排序方式改变后回到第一页
+    if pager["sort"] != (sort_key, descending):
+        pager["sort"] = (sort_key, descending)
+        pager["cursors"] = [None]
+
+    page_df, next_cursor = read_page(
+        table_name, pager["cursors"][-1], page_size, sort_key, descending
+    )
+    # 数据被删除导致当前页为空时，回到第一页
+    if page_df.empty and len(pager["cursors"]) > 1:
+        pager["cursors"] = [None]
+        page_df, next_cursor = read_page(
+            table_name, None, page_size, sort_key, descending
+        )
+
+    grid_res = grid_func(page_df, paginate=False)
+
+    # 翻页按钮
+    total = count_rows(table_name)
+    page_no = len(pager["cursors"])
+    col_prev, col_info, col_next = st.columns([1, 3, 1])
+    with col_prev:
+        if st.button("⬅️ 上一页", key=f"{state_key}_prev", disabled=page_no == 1):
+            pager["cursors"].pop()
+            st.experimental_rerun()
+    with col_info:
+        st.markdown(
+            f"第 {page_no} / {max(1, math.ceil(total / page_size))} 页，共 {total} 条"
+        )
+    with col_next:
+        if st.button(
+            "下一页 ➡️", key=f"{state_key}_next", disabled=next_cursor is None
+        ):
+            pager["cursors"].append(next_cursor)
+            st.experimental_rerun()
+
+    return grid_res
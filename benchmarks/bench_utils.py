@@ -0,0 +1,382 @@
+"""
+utils.normalize_command 和 utils.chinese_sort_key 的性能基准
+
+用法（在项目根目录执行）:
+    python benchmarks/bench_utils.py                  # 运行基准并保存结果
+    python benchmarks/bench_utils.py --quick          # 小规模语料，快速检查
+    python benchmarks/bench_utils.py --compare benchmarks/results/xxx.json
+    python benchmarks/bench_utils.py --update-golden  # 行为有意修改后重新生成标准结果
+
+每项基准输出每秒调用次数和单次调用耗时的p50/p99，结果保存为JSON；
+运行前先把输出与golden_utils.json中的标准结果比对，不一致时退出码为1。
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import platform
+import random
+import sys
+import time
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from utils import chinese_sort_key, normalize_command, normalize_commands  # noqa: E402
+
+try:
+    import pypinyin  # noqa: F401
+
+    HAS_PYPINYIN = True
+except ImportError:
+    HAS_PYPINYIN = False
+
+GOLDEN_FILE = os.path.join(BENCH_DIR, "golden_utils.json")
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+
+# 语料使用固定的随机种子，保证每次运行、每台机器上的输入一致
+SEED = 20240901
+COMMAND_CORPUS_SIZE = 20000
+FILENAME_CORPUS_SIZE = 12000
+QUICK_CORPUS_SIZE = 2000
+
+# 写入标准结果的命令条数（其余命令只比对整体哈希）
+GOLDEN_COMMAND_CASES = 300
+
+# 与上次结果比较时，每秒调用次数下降超过这个比例视为性能退化
+DEFAULT_TOLERANCE = 0.2
+
+
+# ---------- 合成语料 ----------
+
+_COMMAND_NAMES = ["ls", "tail", "head", "grep", "sort", "cat", "echo", "find",
+                  "more", "wc", "cut", "uniq", "chmod", "cp", "mv", "tar"]
+_LETTER_OPTIONS = ["-a", "-l", "-h", "-r", "-n", "-v", "-f", "-i", "-R", "-S",
+                   "-al", "-lh", "-rf", "-Ri", "-nv"]
+_DIGIT_OPTIONS = ["-1", "-5", "-10", "-20", "-6v", "-n20", "-3c"]
+_PLUS_OPTIONS = ["+1", "+3", "+10", "+n", "+F"]
+_LONG_OPTIONS = ["--color", "--help", "--all", "--sort=size", "--max-depth=1"]
+_ARGUMENTS = ["/etc/passwd", "file.txt", "access.log", ".", "*.py", "~/文档",
+              "/tmp/test.txt", "成绩.xlsx", "a", "b", "$HOME"]
+_QUOTED = ["'hello world'", '"hello>world"', "'*.py'", '"a b c"', "'x>>y'",
+           '"2>&1"', "'|'", '"学生 姓名"']
+_REDIRECTIONS = [">", ">>", "<", "2>", "2>>", "&>", "|", "2>&1", ">|"]
+_TARGETS = ["output.txt", "/dev/null", "log.txt", "errors.log", "grep x",
+            "uniq -c", "sort -n"]
+
+
+def make_commands(size, seed=SEED):
+    """生成带引号、重定向和混合选项的shell命令"""
+    rng = random.Random(seed)
+    commands = []
+    for _ in range(size):
+        parts = [rng.choice(_COMMAND_NAMES)]
+        pools = [_LETTER_OPTIONS, _DIGIT_OPTIONS, _PLUS_OPTIONS, _LONG_OPTIONS,
+                 _ARGUMENTS, _QUOTED]
+        for _ in range(rng.randint(0, 6)):
+            parts.append(rng.choice(rng.choice(pools)))
+        for _ in range(rng.choice([0, 0, 1, 1, 2])):
+            redirection = rng.choice(_REDIRECTIONS)
+            target = "" if redirection == "2>&1" else rng.choice(_TARGETS)
+            # 重定向符号与前后内容有时连写，有时用空格分开
+            if rng.random() < 0.5:
+                parts.append(f"{redirection}{target}")
+            else:
+                parts.extend(p for p in (redirection, target) if p)
+        separator = rng.choice([" ", " ", "  ", "\t"])
+        commands.append(separator.join(parts))
+    return commands
+
+
+_SURNAMES = "张王李赵刘陈杨黄吴周徐孙马朱胡郭何高林罗郑梁谢宋唐许韩冯邓曹彭曾肖田董潘袁蔡蒋余杜叶程"
+_GIVEN = "伟芳娜敏静丽强磊军洋勇艳杰娟涛明超秀霞平刚桂英华玉兰文红建志国峰宇浩然思雨欣怡子轩梓涵"
+_WORDS = ["作业", "实验报告", "期末考试", "家访记录", "课堂练习", "成绩单", "答题卡",
+          "计算机应用", "软件技术", "网络安全", "班会", "照片"]
+_EXTENSIONS = [".xlsx", ".docx", ".pdf", ".jpg", ".png", ".zip", ""]
+
+
+def make_filenames(size, seed=SEED):
+    """生成中文、数字、英文混合的文件名"""
+    rng = random.Random(seed)
+    filenames = []
+    for _ in range(size):
+        name = rng.choice(_SURNAMES) + "".join(
+            rng.choice(_GIVEN) for _ in range(rng.randint(1, 2))
+        )
+        pattern = rng.randrange(6)
+        if pattern == 0:
+            stem = f"{rng.randint(20, 25)}{rng.choice(_WORDS)}{rng.randint(1, 9)}班_{name}"
+        elif pattern == 1:
+            stem = f"第{rng.randint(1, 30)}周{rng.choice(_WORDS)}_{name}"
+        elif pattern == 2:
+            stem = f"{rng.randint(1, 60):02d}{name}{rng.choice(_WORDS)}"
+        elif pattern == 3:
+            stem = f"IMG_{rng.randint(0, 9999):04d}"
+        elif pattern == 4:
+            stem = f"{name}-{rng.choice(_WORDS)}-v{rng.randint(1, 12)}"
+        else:
+            stem = f"{2020 + rng.randint(0, 5)}年{rng.randint(1, 12)}月{rng.choice(_WORDS)}"
+        filenames.append(stem + rng.choice(_EXTENSIONS))
+    return filenames
+
+
+# ---------- 计时 ----------
+
+
+def _clear_cache(func):
+    cache_clear = getattr(func, "cache_clear", None)
+    if cache_clear:
+        cache_clear()
+
+
+def _percentile(sorted_values, percent):
+    index = min(int(len(sorted_values) * percent / 100), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def time_calls(func, inputs, repeat=3, before_each=None):
+    """逐次调用计时，返回每秒调用次数和单次耗时的p50/p99（微秒），取最快的一轮"""
+    best = None
+    for _ in range(repeat):
+        if before_each:
+            before_each()
+        samples = []
+        perf_counter_ns = time.perf_counter_ns
+        for value in inputs:
+            start = perf_counter_ns()
+            func(value)
+            samples.append(perf_counter_ns() - start)
+        total = sum(samples)
+        if best is None or total < best[0]:
+            best = (total, samples)
+
+    total, samples = best
+    samples.sort()
+    return {
+        "calls": len(samples),
+        "ops_per_sec": round(len(samples) / (total / 1e9), 1),
+        "p50_us": round(_percentile(samples, 50) / 1000, 3),
+        "p99_us": round(_percentile(samples, 99) / 1000, 3),
+    }
+
+
+def time_total(func, repeat=3, calls=1):
+    """整体计时（例如一次批量调用或一次排序），返回每秒调用次数和总耗时"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter_ns()
+        func()
+        elapsed = time.perf_counter_ns() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return {
+        "calls": calls,
+        "ops_per_sec": round(calls / (best / 1e9), 1),
+        "total_ms": round(best / 1e6, 3),
+    }
+
+
+def run_benchmarks(commands, filenames):
+    results = {}
+    # 不经过LRU缓存，测量归一化本身的开销
+    raw_normalize = getattr(normalize_command, "__wrapped__", normalize_command)
+    results["normalize_command.uncached"] = time_calls(raw_normalize, commands)
+    # 缓存命中：同一批命令重复出现（同班学生答案大多相同）
+    for command in commands[:4096]:
+        normalize_command(command)
+    results["normalize_command.cached"] = time_calls(
+        normalize_command, commands[:4096]
+    )
+    # 批量接口：每个命令重复5次，去重后每个只归一化一次
+    batch = commands * 5
+
+    def normalize_batch():
+        _clear_cache(normalize_command)
+        normalize_commands(batch, max_workers=1)
+
+    results["normalize_commands.batch"] = time_total(normalize_batch, calls=len(batch))
+    _clear_cache(normalize_command)
+
+    results["chinese_sort_key.cold"] = time_calls(
+        chinese_sort_key, filenames, before_each=lambda: _clear_cache(chinese_sort_key)
+    )
+    results["chinese_sort_key.warm"] = time_calls(chinese_sort_key, filenames)
+    results["sorted.filenames"] = time_total(
+        lambda: sorted(filenames, key=chinese_sort_key), calls=len(filenames)
+    )
+    _clear_cache(chinese_sort_key)
+    return results
+
+
+# ---------- 标准结果 ----------
+
+
+def _digest(values):
+    digest = hashlib.sha256()
+    for value in values:
+        digest.update(json.dumps(value, ensure_ascii=False).encode("utf-8"))
+        digest.update(b"\n")
+    return digest.hexdigest()
+
+
+def _sort_key_json(filename):
+    return list(chinese_sort_key(filename))
+
+
+def build_golden(commands, filenames):
+    raw_normalize = getattr(normalize_command, "__wrapped__", normalize_command)
+    return {
+        "normalize_command": {
+            "seed": SEED,
+            "corpus_size": len(commands),
+            "cases": {
+                command: raw_normalize(command)
+                for command in commands[:GOLDEN_COMMAND_CASES]
+            },
+            "corpus_sha256": _digest(raw_normalize(command) for command in commands),
+        },
+        "chinese_sort_key": {
+            "seed": SEED,
+            "corpus_size": len(filenames),
+            # 排序结果依赖pypinyin，只和相同环境下生成的结果比较
+            "pypinyin": HAS_PYPINYIN,
+            "sorted_sha256": _digest(sorted(filenames, key=chinese_sort_key)),
+            "cases": [],
+        },
+    }
+
+
+def check_golden(golden, commands, filenames):
+    """返回{检查项: 结果说明}，结果说明以ok开头表示通过"""
+    report = {}
+    raw_normalize = getattr(normalize_command, "__wrapped__", normalize_command)
+
+    expected = golden["normalize_command"]
+    mismatches = [
+        command
+        for command, output in expected["cases"].items()
+        if raw_normalize(command) != output
+    ]
+    report["normalize_command.cases"] = (
+        f"failed: {len(mismatches)} mismatches, e.g. {mismatches[0]!r}"
+        if mismatches
+        else f"ok ({len(expected['cases'])} cases)"
+    )
+    if len(commands) == expected["corpus_size"]:
+        digest = _digest(raw_normalize(command) for command in commands)
+        report["normalize_command.corpus"] = (
+            "ok" if digest == expected["corpus_sha256"] else "failed: corpus digest differs"
+        )
+
+    # 手写的排序键：不含汉字的在任何环境下都要一致，含汉字的需要pypinyin
+    failures = []
+    checked = 0
+    for case in golden["chinese_sort_key"]["cases"]:
+        if case.get("pypinyin") and not HAS_PYPINYIN:
+            continue
+        checked += 1
+        if _sort_key_json(case["filename"]) != case["key"]:
+            failures.append(case["filename"])
+    report["chinese_sort_key.cases"] = (
+        f"failed: {failures}" if failures else f"ok ({checked} cases)"
+    )
+
+    expected = golden["chinese_sort_key"]
+    if len(filenames) == expected["corpus_size"]:
+        if expected["pypinyin"] != HAS_PYPINYIN:
+            report["chinese_sort_key.corpus"] = "skipped: generated with a different pypinyin setup"
+        else:
+            digest = _digest(sorted(filenames, key=chinese_sort_key))
+            report["chinese_sort_key.corpus"] = (
+                "ok" if digest == expected["sorted_sha256"] else "failed: sorted order differs"
+            )
+    return report
+
+
+def compare_results(previous, current, tolerance):
+    """打印与上次结果的对比，返回性能退化的基准名称列表"""
+    regressions = []
+    print(f"\n对比 {previous.get('timestamp')} 的结果（容差 {tolerance:.0%}）:")
+    for name, result in current["benchmarks"].items():
+        before = previous.get("benchmarks", {}).get(name)
+        if not before:
+            continue
+        ratio = result["ops_per_sec"] / before["ops_per_sec"]
+        flag = ""
+        if ratio < 1 - tolerance:
+            regressions.append(name)
+            flag = "  <-- 退化"
+        print(f"  {name:32s} {ratio:6.2f}x{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--quick", action="store_true", help="使用小规模语料")
+    parser.add_argument("--output", help="结果JSON文件路径，默认保存到benchmarks/results")
+    parser.add_argument("--compare", help="与之前保存的结果JSON比较")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--update-golden", action="store_true", help="重新生成标准结果")
+    args = parser.parse_args()
+
+    commands = make_commands(QUICK_CORPUS_SIZE if args.quick else COMMAND_CORPUS_SIZE)
+    filenames = make_filenames(QUICK_CORPUS_SIZE if args.quick else FILENAME_CORPUS_SIZE)
+
+    if args.update_golden:
+        # 标准结果始终按完整语料生成，手写的排序键用例保留
+        golden = build_golden(make_commands(COMMAND_CORPUS_SIZE), make_filenames(FILENAME_CORPUS_SIZE))
+        if os.path.exists(GOLDEN_FILE):
+            with open(GOLDEN_FILE, encoding="utf-8") as f:
+                golden["chinese_sort_key"]["cases"] = json.load(f)["chinese_sort_key"]["cases"]
+        with open(GOLDEN_FILE, "w", encoding="utf-8") as f:
+            json.dump(golden, f, ensure_ascii=False, indent=2)
+            f.write("\n")
+        print(f"已更新 {GOLDEN_FILE}")
+        return 0
+
+    with open(GOLDEN_FILE, encoding="utf-8") as f:
+        golden = json.load(f)
+    golden_report = check_golden(golden, commands, filenames)
+    print("标准结果检查:")
+    for name, status in golden_report.items():
+        print(f"  {name:32s} {status}")
+
+    benchmarks = run_benchmarks(commands, filenames)
+    print(f"\n{'基准':32s} {'次数':>8s} {'次/秒':>14s} {'p50(us)':>10s} {'p99(us)':>10s}")
+    for name, result in benchmarks.items():
+        print(
+            f"{name:32s} {result['calls']:>8d} {result['ops_per_sec']:>14,.1f} "
+            f"{result.get('p50_us', '-'):>10} {result.get('p99_us', '-'):>10}"
+        )
+
+    results = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "pypinyin": HAS_PYPINYIN,
+        "quick": args.quick,
+        "golden": golden_report,
+        "benchmarks": benchmarks,
+    }
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(
+            RESULTS_DIR, f"utils_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+        )
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+        f.write("\n")
+    print(f"\n结果已保存到 {output}")
+
+    failed = any(status.startswith("failed") for status in golden_report.values())
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            previous = json.load(f)
+        failed = bool(compare_results(previous, results, args.tolerance)) or failed
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,139 @@
+import errno
+import os
+import uuid
+
+from file_operator import (
+    BLOB_STORE_DIR,
+    UPLOAD_TEMP_PREFIX,
+    cached_file_sha256,
+    save_stream,
+    stream_sha256,
+)
+from storage_catalog import EXTERNAL_STORAGE_PATH
+
+
+# 按内容去重保存上传文件（可选，设置BLOB_STORE=1开启）：
+# 每个不同内容的文件只在 外部存储/.blobs/<摘要前两位>/<SHA-256> 保存一份，
+# 分类目录下的文件是它的硬链接。硬链接数就是引用计数：
+# 只剩存储目录中的一个链接时，说明已没有分类引用它，可以删除。
+# 分类下的文件都通过临时文件+重命名替换，不会原地修改共享的内容。
+BLOB_STORE_ENABLED = os.getenv("BLOB_STORE", "") == "1"
+
+BLOB_STORE_PATH = os.path.join(EXTERNAL_STORAGE_PATH, BLOB_STORE_DIR)
+
+
+def blob_path(sha256):
+    return os.path.join(BLOB_STORE_PATH, sha256[:2], sha256)
+
+
+def _link_into(source, file_name):
+    """把source硬链接为file_name，已存在的file_name被原子替换"""
+    directory = os.path.dirname(file_name) or "."
+    temp_name = os.path.join(directory, f"{UPLOAD_TEMP_PREFIX}{uuid.uuid4().hex}.tmp")
+    os.link(source, temp_name)
+    try:
+        os.replace(temp_name, file_name)
+    except BaseException:
+        os.unlink(temp_name)
+        raise
+
+
+def _same_file(path, other):
+    try:
+        return os.path.samefile(path, other)
+    except OSError:
+        return False
+
+
+def _linked_blob(file_name):
+    """file_name是去重存储中某个内容的硬链接时返回其SHA-256，否则返回None"""
+    try:
+        if os.stat(file_name).st_nlink < 2:
+            return None
+    except OSError:
+        return None
+    sha256 = cached_file_sha256(file_name)
+    return sha256 if _same_file(blob_path(sha256), file_name) else None
+
+
+def save_upload(stream, file_name, size=None):
+    """保存上传的文件，返回(目标文件是否有变化, SHA-256)
+
+    未开启去重存储时与save_stream相同。开启后先计算摘要查找已有内容，
+    已保存过的内容只需建立硬链接，不再写入文件数据。
+    """
+    if not BLOB_STORE_ENABLED:
+        return save_stream(stream, file_name, size=size)
+
+    stream.seek(0)
+    sha256 = stream_sha256(stream)
+    blob = blob_path(sha256)
+    if _same_file(blob, file_name):
+        return False, sha256
+
+    # 覆盖已链接到存储的文件后，旧内容可能不再被任何分类引用
+    old_sha256 = _linked_blob(file_name)
+    try:
+        if not os.path.exists(blob):
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            if os.path.isfile(file_name) and cached_file_sha256(file_name) == sha256:
+                # 目标位置已有相同内容的旧文件，直接把它收入存储
+                _link_into(file_name, blob)
+                return False, sha256
+            save_stream(stream, blob, size=size)
+        _link_into(blob, file_name)
+    except OSError as e:
+        # 外部存储不支持硬链接（或跨文件系统）、内容刚被同时删除时按普通方式保存
+        if e.errno not in (
+            errno.EXDEV,
+            errno.EPERM,
+            errno.EMLINK,
+            errno.ENOTSUP,
+            errno.ENOENT,
+        ):
+            raise
+        written, sha256 = save_stream(stream, file_name, size=size)
+    else:
+        written = True
+    if written and old_sha256 is not None:
+        _release_blob(old_sha256)
+    return written, sha256
+
+
+def _release_blob(sha256):
+    """没有分类引用时删除存储中的内容，返回是否删除"""
+    blob = blob_path(sha256)
+    try:
+        if os.stat(blob).st_nlink > 1:
+            return False
+        os.unlink(blob)
+    except OSError:
+        return False
+    return True
+
+
+def remove_file(file_name):
+    """删除分类下的文件，去重存储中不再被引用的内容一起删除"""
+    sha256 = _linked_blob(file_name) if BLOB_STORE_ENABLED else None
+    os.remove(file_name)
+    if sha256 is not None:
+        _release_blob(sha256)
+
+
+def collect_blobs():
+    """删除所有已没有分类引用的内容，用于清理在页面之外删除的文件，返回删除的个数"""
+    removed = 0
+    if not os.path.isdir(BLOB_STORE_PATH):
+        return removed
+    for prefix in os.listdir(BLOB_STORE_PATH):
+        directory = os.path.join(BLOB_STORE_PATH, prefix)
+        if not os.path.isdir(directory):
+            continue
+        for sha256 in os.listdir(directory):
+            if not sha256.startswith(UPLOAD_TEMP_PREFIX) and _release_blob(sha256):
+                removed += 1
+    return removed
+
+
+if __name__ == "__main__":
+    print(f"已删除 {collect_blobs()} 个不再被引用的文件")
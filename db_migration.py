@@ -0,0 +1,331 @@
+import shutil
+import sys
+import tempfile
+
+from sqlalchemy import create_engine, text
+
+from question_stats import CREATE_QUESTION_STATS_SQL, rebuild_question_stats
+from utils import normalize_commands
+
+
+# 数据库结构迁移：按版本号依次执行，当前版本记录在SQLite的user_version中
+# 每个迁移使用固定的建表语句，不依赖ORM模型的当前定义
+
+
+def _column_names(conn, table_name):
+    return {row[1] for row in conn.exec_driver_sql(f"pragma table_info({table_name})")}
+
+
+def _column_types(conn, table_name):
+    return {
+        row[1]: row[2].upper()
+        for row in conn.exec_driver_sql(f"pragma table_info({table_name})")
+    }
+
+
+def _table_exists(conn, table_name):
+    return (
+        conn.exec_driver_sql(
+            "select 1 from sqlite_master where type = 'table' and name = ?",
+            (table_name,),
+        ).first()
+        is not None
+    )
+
+
+def _rebuild_table(conn, table_name, create_sql, column_exprs):
+    """按新的建表语句重建表，column_exprs为{新列名: 从旧表取值的表达式}"""
+    old_table_name = f"{table_name}_old"
+    conn.exec_driver_sql(f"alter table {table_name} rename to {old_table_name}")
+    conn.exec_driver_sql(create_sql)
+    columns = ", ".join(column_exprs)
+    exprs = ", ".join(column_exprs.values())
+    conn.exec_driver_sql(
+        f"insert into {table_name} ({columns}) select {exprs} from {old_table_name}"
+    )
+    # 旧表上的索引随旧表一起删除，之后的迁移会重新创建
+    conn.exec_driver_sql(f"drop table {old_table_name}")
+
+
+# 判断新答题卡开始时比较的题目数
+SHEET_START_MATCH = 3
+
+
+def _sheet_ordinals(questions):
+    """按id顺序的题目文本，返回每一行在所在答题卡中的题目序号
+
+    旧版本重新导入时是追加写入，同一创建者可能有多张答题卡首尾相接。
+    后面几行的题目与当前答题卡开头的几道题相同时，视为一张新答题卡的开始。
+    """
+    ordinals = []
+    sheet_start = 0
+    for index, question in enumerate(questions):
+        sheet_length = index - sheet_start
+        if sheet_length and question == questions[sheet_start]:
+            count = min(SHEET_START_MATCH, sheet_length, len(questions) - index)
+            if (
+                questions[index : index + count]
+                == questions[sheet_start : sheet_start + count]
+            ):
+                sheet_start = index
+        ordinals.append(index - sheet_start)
+    return ordinals
+
+
+def _backfill_sheet_ordinals(conn, only_missing=True):
+    """按答题卡为questions编号，only_missing为真时只处理还有未编号行的创建者"""
+    having = "having sum(ordinal is null) > 0" if only_missing else ""
+    groups = conn.exec_driver_sql(
+        "select class_name, creator from questions "
+        f"group by class_name, creator {having}"
+    ).fetchall()
+    updates = []
+    for class_name, creator in groups:
+        rows = conn.execute(
+            text(
+                "select id, question, ordinal from questions "
+                "where class_name is :class_name and creator is :creator order by id"
+            ),
+            {"class_name": class_name, "creator": creator},
+        ).fetchall()
+        ordinals = _sheet_ordinals([row[1] for row in rows])
+        updates.extend(
+            {"id": row[0], "ordinal": ordinal}
+            for row, ordinal in zip(rows, ordinals)
+            if row[2] != ordinal
+        )
+    if updates:
+        conn.execute(
+            text("update questions set ordinal = :ordinal where id = :id"), updates
+        )
+
+
+def _add_normalized_answers(conn):
+    """questions表增加normalized_answer和ordinal列，并回填已有数据"""
+    columns = _column_names(conn, "questions")
+    if "normalized_answer" not in columns:
+        conn.exec_driver_sql(
+            "alter table questions add column normalized_answer VARCHAR(100)"
+        )
+    if "ordinal" not in columns:
+        conn.exec_driver_sql("alter table questions add column ordinal INTEGER")
+
+    # 旧数据按答题卡编号：同一创建者、同一班级内按id顺序，每张答题卡从0开始
+    _backfill_sheet_ordinals(conn)
+
+    rows = conn.exec_driver_sql(
+        "select id, answer from questions where normalized_answer is null"
+    ).fetchall()
+    if rows:
+        # 所有学生的答案一起去重归一化
+        normalized = normalize_commands(str(row[1]) for row in rows)
+        conn.execute(
+            text(
+                "update questions set normalized_answer = :normalized_answer "
+                "where id = :id"
+            ),
+            [
+                {"id": question_id, "normalized_answer": normalized_answer}
+                for (question_id, _), normalized_answer in zip(rows, normalized)
+            ],
+        )
+
+
+def _typed_score_and_time(conn):
+    """分数改为REAL类型，添加时间改为DATETIME类型"""
+    if _column_types(conn, "questions").get("score") not in ("FLOAT", "REAL"):
+        _rebuild_table(
+            conn,
+            "questions",
+            "create table questions ("
+            "id INTEGER NOT NULL, "
+            "question VARCHAR(300), "
+            "answer VARCHAR(100), "
+            "score FLOAT, "
+            "creator VARCHAR(16), "
+            "class_name VARCHAR(16), "
+            "add_time DATETIME, "
+            "normalized_answer VARCHAR(100), "
+            "ordinal INTEGER, "
+            "PRIMARY KEY (id))",
+            {
+                "id": "id",
+                "question": "question",
+                "answer": "answer",
+                "score": "cast(score as real)",
+                "creator": "creator",
+                "class_name": "class_name",
+                # 无法识别的时间文本置空，其余保持原来的ISO格式
+                "add_time": "case when datetime(add_time) is null then null "
+                "else add_time end",
+                "normalized_answer": "normalized_answer",
+                "ordinal": "ordinal",
+            },
+        )
+    if _column_types(conn, "students").get("score") not in ("FLOAT", "REAL"):
+        _rebuild_table(
+            conn,
+            "students",
+            "create table students ("
+            "id INTEGER NOT NULL, "
+            "name VARCHAR(100), "
+            "class_name VARCHAR(16), "
+            "score FLOAT, "
+            "PRIMARY KEY (id))",
+            {
+                "id": "id",
+                "name": "name",
+                "class_name": "class_name",
+                "score": "cast(score as real)",
+            },
+        )
+
+
+def _composite_indexes(conn):
+    """按班级筛选题目和学生时使用的组合索引"""
+    conn.exec_driver_sql(
+        "create index if not exists ix_questions_answer_key "
+        "on questions (class_name, ordinal, normalized_answer)"
+    )
+    conn.exec_driver_sql(
+        "create index if not exists ix_questions_class_creator "
+        "on questions (class_name, creator)"
+    )
+    conn.exec_driver_sql(
+        "create index if not exists ix_students_class_name "
+        "on students (class_name, name)"
+    )
+
+
+def _question_stats(conn):
+    """创建题目分析统计表，并按已有答题记录汇总"""
+    conn.exec_driver_sql(CREATE_QUESTION_STATS_SQL)
+    rebuild_question_stats(conn)
+
+
+def _unique_sheet_rows(conn):
+    """去掉重复导入的答题卡，每个(班级, 创建者, 题目序号)和每个(班级, 学生)只保留最新的一行"""
+    # 早先的迁移按创建者连续编号，追加导入的多张答题卡没有分开，这里按答题卡重新编号
+    _backfill_sheet_ordinals(conn, only_missing=False)
+    conn.exec_driver_sql(
+        "delete from questions where ordinal is not null and id not in ("
+        "select max(id) from questions group by class_name, creator, ordinal)"
+    )
+    conn.exec_driver_sql(
+        "delete from students where id not in ("
+        "select max(id) from students group by class_name, name)"
+    )
+    # 唯一索引的前缀已经覆盖按(班级, 创建者)和(班级, 姓名)的查询，原来的普通索引不再需要
+    conn.exec_driver_sql("drop index if exists ix_questions_class_creator")
+    conn.exec_driver_sql("drop index if exists ix_students_class_name")
+    conn.exec_driver_sql(
+        "create unique index if not exists ux_questions_class_creator_ordinal "
+        "on questions (class_name, creator, ordinal)"
+    )
+    conn.exec_driver_sql(
+        "create unique index if not exists ux_students_class_name "
+        "on students (class_name, name)"
+    )
+    # 去重后按保留的答题记录重新汇总学生总分和题目统计
+    conn.exec_driver_sql(
+        "update students set score = ("
+        "select coalesce(sum(q.score), 0) from questions q "
+        "where q.class_name = students.class_name and q.creator = students.name)"
+    )
+    rebuild_question_stats(conn)
+
+
+def _sort_indexes(conn):
+    """分页排序列的(排序列, id)索引，键集分页的每一页都按索引定位"""
+    for table_name, columns in (
+        ("questions", ("class_name", "creator", "score", "add_time")),
+        ("students", ("class_name", "name", "score")),
+    ):
+        for column in columns:
+            conn.exec_driver_sql(
+                f"create index if not exists ix_{table_name}_{column}_id "
+                f"on {table_name} ({column}, id)"
+            )
+
+
+# 迁移列表：(版本号, 说明, 迁移函数)，版本号必须递增
+MIGRATIONS = [
+    (1, "questions增加归一化答案和题目序号", _add_normalized_answers),
+    (2, "分数和添加时间改为原生类型", _typed_score_and_time),
+    (3, "增加按班级查询的组合索引", _composite_indexes),
+    (4, "增加题目分析统计表", _question_stats),
+    (5, "重新导入时覆盖答题卡，增加唯一索引", _unique_sheet_rows),
+    (6, "增加分页排序列的索引", _sort_indexes),
+]
+
+
+def get_schema_version(conn):
+    return conn.exec_driver_sql("pragma user_version").scalar()
+
+
+def run_migrations(engine):
+    """执行所有未执行的迁移，每个迁移在单独的事务中完成，返回执行的版本号列表"""
+    applied = []
+    for version, description, migrate in MIGRATIONS:
+        with engine.begin() as conn:
+            # sqlite3驱动不会为DDL语句开启事务，这里显式开启，保证重建表等操作的原子性
+            conn.exec_driver_sql("begin")
+            if get_schema_version(conn) >= version:
+                continue
+            # 表还没有创建时（例如只建了部分表的旧库）跳过，版本号照常记录
+            if _table_exists(conn, "questions") and _table_exists(conn, "students"):
+                migrate(conn)
+            conn.exec_driver_sql(f"pragma user_version = {version}")
+        applied.append(version)
+    return applied
+
+
+def check_sheet_rows(conn):
+    """检查迁移后的答题数据，返回发现的问题列表，没有问题时为空"""
+    problems = []
+    duplicated = conn.exec_driver_sql(
+        "select count(*) from (select 1 from questions "
+        "group by class_name, creator, ordinal having count(*) > 1)"
+    ).scalar()
+    if duplicated:
+        problems.append(f"{duplicated} 个(班级, 创建者, 题目序号)有重复的答题记录")
+    duplicated = conn.exec_driver_sql(
+        "select count(*) from (select 1 from students "
+        "group by class_name, name having count(*) > 1)"
+    ).scalar()
+    if duplicated:
+        problems.append(f"{duplicated} 个(班级, 学生)有重复的总分记录")
+    # 追加导入的答题卡没有分开编号时，题目序号会超出标准答案的题数
+    overflowing = conn.exec_driver_sql(
+        "select count(distinct q.class_name || '/' || q.creator) from questions q "
+        "join (select class_name, count(*) as key_length from questions "
+        "where creator = 'admin' group by class_name) k "
+        "on k.class_name = q.class_name "
+        "where q.creator != 'admin' and q.ordinal >= k.key_length"
+    ).scalar()
+    if overflowing:
+        problems.append(f"{overflowing} 张答题卡的题目序号超出标准答案的题数")
+    mismatched = conn.exec_driver_sql(
+        "select count(*) from students where score is not ("
+        "select coalesce(sum(q.score), 0) from questions q "
+        "where q.class_name = students.class_name and q.creator = students.name)"
+    ).scalar()
+    if mismatched:
+        problems.append(f"{mismatched} 名学生的总分与答题记录不一致")
+    return problems
+
+
+if __name__ == "__main__":
+    # 在数据库的副本上执行全部迁移并检查结果，不修改原数据库：
+    #   python db_migration.py [数据库文件，默认myDB.db]
+    source = sys.argv[1] if len(sys.argv) > 1 else "myDB.db"
+    with tempfile.TemporaryDirectory() as directory:
+        copy = shutil.copy(source, directory)
+        engine = create_engine(f"sqlite:///{copy}")
+        print(f"执行迁移: {run_migrations(engine)}")
+        with engine.connect() as conn:
+            problems = check_sheet_rows(conn)
+        engine.dispose()
+    for problem in problems:
+        print(problem)
+    sys.exit(1 if problems else 0)
@@ -1,35 +1,126 @@
 import pandas as pd
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Text
+from sqlalchemy import create_engine, event, text, bindparam, Column, Index, Integer, Float, String, DateTime, Text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import sessionmaker, scoped_session
 from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime, timedelta
+from collections import namedtuple
+import numpy as np
 import streamlit as st
+import multiprocessing
+import os
 import secrets
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 
 from file_operator import *
-from utils import normalize_command
+from file_operator import file_sha256
+from utils import normalize_commands
+from db_migration import run_migrations
+from question_stats import add_sheet_stats, rebuild_question_stats
 
 # 建立ORM基础类
 Base = declarative_base()
 
 # 全局数据库连接引擎和会话工厂
 _engine = None
+_engine_lock = threading.Lock()
 _session_factory = None
 
+# 每个SQLite连接建立时设置的PRAGMA
+SQLITE_PRAGMAS = (
+    # WAL模式下读不阻塞写、写不阻塞读
+    ("journal_mode", "WAL"),
+    # 遇到锁时最多等待30秒，而不是立即报"database is locked"
+    ("busy_timeout", 30000),
+    # WAL模式下NORMAL已能保证一致性，减少fsync次数
+    ("synchronous", "NORMAL"),
+    # 使用256MB内存映射读取数据库文件
+    ("mmap_size", 256 * 1024 * 1024),
+    # 页缓存64MB（负数表示KB）
+    ("cache_size", -64000),
+    # 临时表和排序使用内存
+    ("temp_store", "MEMORY"),
+)
+
+# 定期执行WAL检查点的间隔（秒）
+WAL_CHECKPOINT_INTERVAL = 300
+
+# 按班级缓存的标准答案（已归一化），只在该班admin答题卡导入或删除时失效
+_answer_key_cache = {}
+_answer_key_lock = threading.Lock()
+
+# 查询缓存的版本号：写入数据后只递增受影响的表的版本号，
+# 缓存键包含版本号，其他表的缓存不受影响
+_table_generations = {}  # 表 -> 版本号，该表任意数据变化都会递增
+_generation_lock = threading.Lock()
+
+# 后台导入任务的线程池，模块级单例，页面重跑和切换页面都不会中断
+# 只用一个工作线程，保证先提交的任务（例如标准答案）先完成
+IMPORT_JOB_WORKERS = 1
+_import_executor = None
+_import_executor_lock = threading.Lock()
+# 本进程是否已把上次运行遗留的未完成任务标记为中止
+_interrupted_jobs_marked = False
+
+# 学生答题卡评分的进程池，第一次使用时创建，之后的导入任务都复用它
+# 服务进程中已有多个线程，fork时可能复制到被其他线程持有的锁导致子进程死锁，
+# 因此用forkserver（不支持时用spawn）启动子进程
+GRADING_WORKERS = os.cpu_count() or 1
+_grading_executor = None
+_grading_executor_lock = threading.Lock()
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """新建连接时设置SQLite的PRAGMA"""
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in SQLITE_PRAGMAS:
+            cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
+
+
+def _run_wal_checkpoints(engine, interval):
+    """后台线程：定期把WAL文件中的数据写回数据库文件，避免WAL无限增长"""
+    while True:
+        time.sleep(interval)
+        try:
+            with engine.connect() as conn:
+                # PASSIVE模式不等待正在进行的读写
+                conn.exec_driver_sql("PRAGMA wal_checkpoint(PASSIVE)")
+        except Exception:
+            # 检查点失败时等待下一次执行
+            pass
+
 
 def get_engine():
     """获取全局数据库引擎，使用连接池"""
     global _engine
     if _engine is None:
-        # 使用连接池，设置echo=False减少日志输出
-        _engine = create_engine(
-            "sqlite:///myDB.db",
-            echo=False,  # 关闭详细日志
-            pool_size=5,  # 连接池大小
-            max_overflow=10,  # 最大溢出连接数
-            pool_pre_ping=True,  # 连接前检查
-            pool_recycle=3600,  # 连接回收时间（秒）
-        )
+        with _engine_lock:
+            if _engine is None:
+                # 使用连接池，设置echo=False减少日志输出
+                engine = create_engine(
+                    "sqlite:///myDB.db",
+                    echo=False,  # 关闭详细日志
+                    pool_size=5,  # 连接池大小
+                    max_overflow=10,  # 最大溢出连接数
+                    pool_pre_ping=True,  # 连接前检查
+                    pool_recycle=3600,  # 连接回收时间（秒）
+                    # sqlite3自身的锁等待时间（秒），与busy_timeout一致
+                    connect_args={"timeout": 30, "check_same_thread": False},
+                )
+                event.listen(engine, "connect", _set_sqlite_pragmas)
+                threading.Thread(
+                    target=_run_wal_checkpoints,
+                    args=(engine, WAL_CHECKPOINT_INTERVAL),
+                    name="wal-checkpoint",
+                    daemon=True,
+                ).start()
+                _engine = engine
     return _engine
 
 
@@ -64,10 +155,30 @@ class Question(Base):
     # 指定question映射到question字段; question字段为字符串类形
     question = Column(String(300))
     answer = Column(String(100))
-    score = Column(Integer)
+    score = Column(Float)
     creator = Column(String(16))
     class_name = Column(String(16))
-    add_time = Column(String(16))
+    add_time = Column(DateTime)
+    # 归一化后的答案和题目序号（答题卡中的第几题，从0开始），评分时按它们关联标准答案
+    normalized_answer = Column(String(100))
+    ordinal = Column(Integer)
+
+    __table_args__ = (
+        Index("ix_questions_answer_key", "class_name", "ordinal", "normalized_answer"),
+        # 每个创建者在每个班级的每道题只保留一行，重新导入时覆盖
+        Index(
+            "ux_questions_class_creator_ordinal",
+            "class_name",
+            "creator",
+            "ordinal",
+            unique=True,
+        ),
+        # 分页时可选的排序列，按(排序列, id)键集分页
+        Index("ix_questions_class_name_id", "class_name", "id"),
+        Index("ix_questions_creator_id", "creator", "id"),
+        Index("ix_questions_score_id", "score", "id"),
+        Index("ix_questions_add_time_id", "add_time", "id"),
+    )
 
 
 # 定义Student的ORM映射
@@ -78,7 +189,82 @@ class Student(Base):
     id = Column(Integer, primary_key=True, autoincrement=True)
     name = Column(String(100))
     class_name = Column(String(16))
-    score = Column(Integer)
+    score = Column(Float)
+
+    __table_args__ = (
+        # 每个班级的每个学生只有一行总分
+        Index("ux_students_class_name", "class_name", "name", unique=True),
+        # 分页时可选的排序列，按(排序列, id)键集分页
+        Index("ix_students_class_name_id", "class_name", "id"),
+        Index("ix_students_name_id", "name", "id"),
+        Index("ix_students_score_id", "score", "id"),
+    )
+
+
+# 定义ImportRecord的ORM映射，记录已导入的答题卡文件
+class ImportRecord(Base):
+    # 指定本类映射到imports表
+    __tablename__ = "imports"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    file_name = Column(String(255), unique=True, nullable=False, index=True)
+    file_size = Column(Integer)
+    mtime = Column(Float)
+    sha256 = Column(String(64))
+    creator = Column(String(16))
+    class_name = Column(String(16))
+    row_count = Column(Integer)
+    imported_at = Column(DateTime, default=datetime.now)
+
+
+# 定义QuestionStat的ORM映射，按班级和题目序号保存题目分析统计
+# 各列含义和更新方式见question_stats.py
+class QuestionStat(Base):
+    # 指定本类映射到question_stats表
+    __tablename__ = "question_stats"
+
+    class_name = Column(String(16), primary_key=True)
+    ordinal = Column(Integer, primary_key=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    correct = Column(Integer, nullable=False, default=0)
+    total_sum = Column(Float, nullable=False, default=0)
+    total_sq_sum = Column(Float, nullable=False, default=0)
+    correct_total_sum = Column(Float, nullable=False, default=0)
+    correct_rate = Column(Float)
+    discrimination = Column(Float)
+
+
+# 定义StorageFile的ORM映射，持久化外部存储目录的文件索引（见storage_catalog.py）
+class StorageFile(Base):
+    # 指定本类映射到storage_files表
+    __tablename__ = "storage_files"
+
+    # 分类（外部存储下的子目录）名，根目录下的文件为空字符串
+    category = Column(String(255), primary_key=True)
+    # 文件名，空字符串表示分类目录本身（用于记录空分类）
+    name = Column(String(255), primary_key=True)
+    size = Column(Integer)
+    mtime = Column(Float)
+
+
+# 定义ImportJob的ORM映射，记录后台导入任务的状态和进度
+class ImportJob(Base):
+    # 指定本类映射到jobs表
+    __tablename__ = "jobs"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    # pending：排队中，running：导入中，done：已完成，failed：任务异常中止
+    status = Column(String(16), nullable=False, default="pending", index=True)
+    total = Column(Integer, default=0)
+    succeeded = Column(Integer, default=0)
+    failed = Column(Integer, default=0)
+    current_file = Column(String(255))
+    # 导入成功的文件名和错误信息，每行一条
+    imported_files = Column(Text, default="")
+    errors = Column(Text, default="")
+    created_at = Column(DateTime, default=datetime.now)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
 
 
 # 创建所有表
@@ -86,6 +272,10 @@ def init_db():
     """初始化数据库，创建所有未创建的表"""
     engine = get_engine()
     Base.metadata.create_all(engine)
+    # 执行数据库结构迁移（旧库补齐列、类型和索引）
+    run_migrations(engine)
+    # 进程启动时就处理上次遗留的任务，否则页面会一直显示它们在进行中
+    _recover_import_jobs()
 
 
 def create_session(username, name, email, expiry_hours=24):
@@ -158,106 +348,339 @@ def cleanup_expired_sessions():
         session.close()
 
 
-# excel导入数据库表questions
-def to_sql_questions(xls_df, creator, class_name):
-    # 使用全局会话
+# 标准答案缓存项：answers为归一化后的标准答案，values为分值数组
+AnswerKey = namedtuple("AnswerKey", ["answers", "values"])
+
+EMPTY_ANSWER_KEY = AnswerKey(np.array([], dtype=object), np.zeros(0))
+
+
+def _score_value(score):
+    """把分值转换为浮点数，无法转换时按0分处理"""
+    try:
+        return float(str(score))
+    except ValueError:
+        return 0.0
+
+
+# 班级的标准答案：每个题目序号取最早导入的那一行
+ANSWER_KEY_SQL = (
+    "(select ordinal, normalized_answer, score from questions where id in ("
+    "select min(id) from questions "
+    "where creator = 'admin' and class_name = :class_name group by ordinal"
+    "))"
+)
+
+
+def get_answer_key(class_name):
+    """获取班级的标准答案，每个班级只查询并归一化一次"""
+    with _answer_key_lock:
+        answer_key = _answer_key_cache.get(class_name)
+    if answer_key is not None:
+        return answer_key
+
+    engine = get_engine()
+    # 导入时已保存归一化后的标准答案，这里不需要再归一化
+    stander_answer = pd.read_sql(
+        f"select normalized_answer, score from {ANSWER_KEY_SQL} order by ordinal",
+        engine,
+        params={"class_name": class_name},
+    )
+    if stander_answer.empty:
+        answer_key = EMPTY_ANSWER_KEY
+    else:
+        answer_key = AnswerKey(
+            stander_answer["normalized_answer"].to_numpy(dtype=object).astype(str).astype(object),
+            stander_answer["score"].fillna(0).to_numpy(dtype=float),
+        )
+
+    with _answer_key_lock:
+        _answer_key_cache[class_name] = answer_key
+    return answer_key
+
+
+def invalidate_answer_key(class_name=None):
+    """使班级的标准答案缓存失效，class_name为空时清空所有班级"""
+    with _answer_key_lock:
+        if class_name is None:
+            _answer_key_cache.clear()
+        else:
+            _answer_key_cache.pop(class_name, None)
+
+
+# 读取导入台账
+def get_import_ledger():
+    """返回{文件名: (文件大小, 修改时间, SHA-256)}，一次查询后按文件名O(1)查找"""
     session = get_session()
     try:
-        # 检查数据框是否为空
-        if xls_df.empty:
-            return False, "Excel文件为空或格式不正确"
-
-        # 检查数据框列数是否足够
-        if len(xls_df.columns) < 3:
-            return (
-                False,
-                f"Excel文件列数不足，需要至少3列，当前有{len(xls_df.columns)}列",
-            )
+        return {
+            record.file_name: (record.file_size, record.mtime, record.sha256)
+            for record in session.query(ImportRecord)
+        }
+    finally:
+        session.close()
+
+
+# 生成文件指纹，用于导入台账
+def file_fingerprint(file_name, file_path, sha256=None):
+    file_stat = os.stat(file_path)
+    return {
+        "file_name": file_name,
+        "file_size": file_stat.st_size,
+        "mtime": file_stat.st_mtime,
+        "sha256": sha256 or file_sha256(file_path),
+    }
+
+
+# 在同一事务中写入或更新文件的导入记录
+def _record_import(session, fingerprint, creator, class_name, row_count):
+    values = dict(
+        fingerprint,
+        creator=creator,
+        class_name=class_name,
+        row_count=row_count,
+        imported_at=datetime.now(),
+    )
+    stmt = sqlite_insert(ImportRecord.__table__).values(**values)
+    session.execute(
+        stmt.on_conflict_do_update(
+            index_elements=["file_name"],
+            set_={key: stmt.excluded[key] for key in values if key != "file_name"},
+        )
+    )
+
 
-        # 获取标准答案
+# 从导入台账中删除答题卡的记录，删除数据后同一文件可以重新导入
+def _forget_imports(session, class_name=None, creator=None):
+    """class_name和creator都为空时删除所有学生答题卡的记录（保留标准答案）"""
+    query = session.query(ImportRecord)
+    if class_name is None and creator is None:
+        query = query.filter(ImportRecord.creator != "admin")
+    else:
+        query = query.filter(
+            ImportRecord.class_name == class_name, ImportRecord.creator == creator
+        )
+    query.delete(synchronize_session=False)
+
+
+# 跳过台账中未变化的文件，files为(文件名, 文件路径, 创建者, 班级)列表
+def skip_imported_files(files):
+    """返回(待导入列表, 已跳过的文件名列表)，待导入项末尾附带文件指纹"""
+    ledger = get_import_ledger()
+    pending_files = []
+    skipped_files = []
+    touched = []
+
+    for file_name, file_path, creator, class_name in files:
         try:
-            stander_answer = read_data("questions", "answer,score", "admin", class_name)
-            # 检查是否真的找到了标准答案
-            if stander_answer.empty:
-                # 如果没有标准答案，创建一个空的stander_answer
-                stander_answer = {"answer": [], "score": []}
-            else:
-                stander_answer = dict(stander_answer)
-        except Exception as e:
-            # 如果查询过程出现异常，创建一个空的stander_answer
-            stander_answer = {"answer": [], "score": []}
-
-        i = 0
-
-        # 只有当创建者不是admin时才创建学生对象
-        student_obj = None
-        if creator != "admin":
-            student_obj = Student(
-                name=creator,
-                class_name=class_name,
-                score=0,
+            file_stat = os.stat(file_path)
+        except OSError:
+            # 文件无法访问时交给导入流程报告错误
+            pending_files.append((file_name, file_path, creator, class_name, None))
+            continue
+
+        record = ledger.get(file_name)
+        # 大小和修改时间都未变化，只需要一次stat就能跳过
+        if record and record[:2] == (file_stat.st_size, file_stat.st_mtime):
+            skipped_files.append(file_name)
+            continue
+
+        fingerprint = file_fingerprint(file_name, file_path)
+        # 内容未变化（例如只是被复制或touch过），更新台账中的大小和修改时间
+        if record and record[2] == fingerprint["sha256"]:
+            skipped_files.append(file_name)
+            touched.append(fingerprint)
+            continue
+
+        pending_files.append((file_name, file_path, creator, class_name, fingerprint))
+
+    if touched:
+        session = get_session()
+        try:
+            for fingerprint in touched:
+                session.query(ImportRecord).filter(
+                    ImportRecord.file_name == fingerprint["file_name"]
+                ).update(
+                    {
+                        ImportRecord.file_size: fingerprint["file_size"],
+                        ImportRecord.mtime: fingerprint["mtime"],
+                    }
+                )
+            session.commit()
+        except Exception:
+            session.rollback()
+        finally:
+            session.close()
+
+    return pending_files, skipped_files
+
+
+# 校验并评分一张答题卡（不访问数据库，可在子进程中执行）
+def grade_answer_sheet(xls_df, creator, class_name, answer_key=EMPTY_ANSWER_KEY):
+    """返回(是否成功, (题目行列表, 学生总分))；失败时第二项为错误信息"""
+    # 检查数据框是否为空
+    if xls_df.empty:
+        return False, "Excel文件为空或格式不正确"
+
+    # 检查数据框列数是否足够
+    if len(xls_df.columns) < 3:
+        return (
+            False,
+            f"Excel文件列数不足，需要至少3列，当前有{len(xls_df.columns)}列",
+        )
+
+    values = xls_df.to_numpy(dtype=object)
+    row_count, column_count = values.shape
+
+    # 整列转换为文本，与逐个单元格str()的结果一致
+    questions = values[:, 1].astype(str).tolist()
+    answers = values[:, 2].astype(str).tolist()
+
+    # 归一化整列答案，和题目序号一起保存，供之后在数据库中直接关联标准答案
+    normalized = np.array(normalize_commands(answers), dtype=object)
+
+    if creator == "admin":
+        # 如果是admin导入标准答案，直接使用第4列的分数，没有提供分数时默认为0
+        if column_count >= 4:
+            scores = np.array([_score_value(score) for score in values[:, 3]])
+        else:
+            scores = np.zeros(row_count)
+        # 标准答案不统计学生总分
+        student_score = None
+    else:
+        scores = np.zeros(row_count)
+        student_score = 0.0
+
+        # 只比较有标准答案的题目
+        key_count = min(row_count, len(answer_key.answers))
+        if key_count:
+            matched = normalized[:key_count] == answer_key.answers[:key_count]
+            scores[:key_count][matched] = answer_key.values[:key_count][matched]
+            # 只有答对题目时才累加分数；cumsum按顺序累加，与逐题累加浮点数的结果一致
+            if matched.any():
+                student_score = float(np.cumsum(answer_key.values[:key_count][matched])[-1])
+
+    # 同一批次的题目使用相同的添加时间
+    add_time = datetime.now()
+
+    # 整理成待批量写入的题目行
+    question_rows = [
+        {
+            "question": question,
+            "answer": answer,
+            "score": float(score),
+            "add_time": add_time,
+            "class_name": class_name,
+            "creator": creator,
+            "normalized_answer": normalized_answer,
+            "ordinal": ordinal,
+        }
+        for ordinal, (question, answer, normalized_answer, score) in enumerate(
+            zip(questions, answers, normalized, scores)
+        )
+    ]
+
+    return True, (question_rows, student_score)
+
+
+# 学生总分：该学生在本班全部答题记录的得分之和，按(class_name, creator)索引聚合
+STUDENT_TOTAL_SQL = (
+    "(select coalesce(sum(q.score), 0) from questions q "
+    "where q.class_name = students.class_name and q.creator = students.name)"
+)
+
+
+def _refresh_student_totals(session, class_name=None, names=None):
+    """按答题记录重新汇总学生总分，可限定班级和学生，返回总分发生变化的学生数"""
+    sql = (
+        f"update students set score = {STUDENT_TOTAL_SQL} "
+        f"where score is not {STUDENT_TOTAL_SQL}"
+    )
+    params = {}
+    if class_name is not None:
+        sql += " and class_name = :class_name"
+        params["class_name"] = class_name
+    statement = text(sql)
+    if names is not None:
+        statement = text(sql + " and name in :names").bindparams(
+            bindparam("names", expanding=True)
+        )
+        params["names"] = list(names)
+    return session.execute(statement, params).rowcount
+
+
+# 读取并评分一个Excel答题卡，供进程池并行调用
+def grade_xlsx_file(file_name, creator, class_name, answer_key):
+    xls_df = read_xlsx(file_name)
+    return grade_answer_sheet(xls_df, creator, class_name, answer_key)
+
+
+# 把评分完成的题目行和学生总分写入数据库
+def to_sql_graded_sheet(
+    creator, class_name, question_rows, student_score, fingerprint=None
+):
+    """同一创建者重新导入时覆盖原来的答题卡，整个过程在一个事务中完成"""
+    session = get_session()
+    try:
+        sheet_filter = (Question.class_name == class_name) & (
+            Question.creator == creator
+        )
+        # 已导入过时，先从题目统计中减去旧答题卡的贡献
+        if student_score is not None:
+            old_rows = [
+                {"ordinal": ordinal, "score": score}
+                for ordinal, score in session.query(
+                    Question.ordinal, Question.score
+                ).filter(sheet_filter)
+            ]
+            if old_rows:
+                old_total = sum(row["score"] or 0 for row in old_rows)
+                add_sheet_stats(session, class_name, old_rows, old_total, sign=-1)
+
+        # 使用Core的executemany一次性写入整张答题卡，已有的题目按(班级, 创建者, 题目序号)覆盖
+        if question_rows:
+            stmt = sqlite_insert(Question.__table__)
+            session.execute(
+                stmt.on_conflict_do_update(
+                    index_elements=["class_name", "creator", "ordinal"],
+                    set_={
+                        key: stmt.excluded[key]
+                        for key in question_rows[0]
+                        if key not in ("class_name", "creator", "ordinal")
+                    },
+                ),
+                question_rows,
             )
+        # 新答题卡题目更少时，删除多出来的旧题目
+        session.query(Question).filter(
+            sheet_filter, Question.ordinal >= len(question_rows)
+        ).delete(synchronize_session=False)
 
-        # 数据写入数据库
-        for row_index, row in enumerate(xls_df.values):
-            # 答案处理
-            try:
-                answer = str(row[2]) if len(row) > 2 else ""
-            except (IndexError, ValueError) as e:
-                return False, f"第{row_index + 1}行数据格式错误：{str(e)}"
-
-            # 分数处理
-            score = "0"  # 默认值
-
-            # 判断是否为标准答案导入
-            if creator == "admin":
-                # 如果是admin导入标准答案，直接使用row中的分数
-                if len(row) >= 4:
-                    try:
-                        score = str(row[3])
-                    except (IndexError, ValueError):
-                        score = "0"
-                else:
-                    score = "0"  # 如果没有提供分数，默认为0
-            elif stander_answer and len(stander_answer.get("answer", [])) > i:
-                # 只有当有标准答案时才进行比较
-                if normalize_command(stander_answer["answer"][i]) == normalize_command(
-                    answer
-                ):
-                    score = stander_answer["score"][i]
-                    if student_obj:  # 只有存在学生对象时才累加分数
-                        # 修复：将score转换为字符串后再检查是否为数字
-                        score_str = str(score)
-                        # 修改为更通用的数值转换方式，可以处理整数和浮点数
-                        try:
-                            student_obj.score += float(score_str)
-                        except ValueError:
-                            # 如果无法转换为浮点数，则按0分处理
-                            student_obj.score += 0.0
-
-            score = str(score)
-
-            # 实例化Question类
-            question_obj = Question(
-                question=str(row[1]) if len(row) > 1 else "",
-                answer=answer,
-                score=score,
-                add_time=datetime.now(),
-                class_name=class_name,
-                creator=creator,
+        # 只有当创建者不是admin时才添加学生信息，总分由答题记录汇总得到
+        if student_score is not None:
+            session.execute(
+                sqlite_insert(Student.__table__)
+                .values(name=creator, class_name=class_name)
+                .on_conflict_do_nothing(index_elements=["class_name", "name"])
             )
-            session.add(question_obj)
-            i += 1
+            _refresh_student_totals(session, class_name, [creator])
+            # 在同一事务中把这张答题卡累加到题目分析统计
+            add_sheet_stats(session, class_name, question_rows, student_score)
 
-        # 只有当创建者不是admin时才添加学生信息
-        if student_obj:
-            student_obj.score = str(student_obj.score)
-            session.add(student_obj)
+        # 有文件指纹时，在同一事务中记入导入台账
+        if fingerprint:
+            _record_import(
+                session, fingerprint, creator, class_name, len(question_rows)
+            )
 
         # 保存
         session.commit()
-        # 清除缓存，确保数据立即更新
-        clear_cache()
+        # 标准答案变化后，使该班级的标准答案缓存失效
+        if creator == "admin":
+            invalidate_answer_key(class_name)
+        # 使相关表的查询缓存失效，确保数据立即更新
+        invalidate_cache("questions")
+        if student_score is not None:
+            invalidate_cache("students")
         return True, "导入成功"
     except Exception as e:
         session.rollback()
@@ -266,33 +689,534 @@ def to_sql_questions(xls_df, creator, class_name):
         session.close()
 
 
+# excel导入数据库表questions
+def to_sql_questions(xls_df, creator, class_name, fingerprint=None):
+    # 获取标准答案（按班级缓存，已归一化）
+    answer_key = EMPTY_ANSWER_KEY
+    if creator != "admin":
+        try:
+            answer_key = get_answer_key(class_name)
+        except Exception as e:
+            # 如果查询过程出现异常，按没有标准答案处理
+            answer_key = EMPTY_ANSWER_KEY
+
+    try:
+        success, result = grade_answer_sheet(xls_df, creator, class_name, answer_key)
+    except Exception as e:
+        return False, f"导入数据时出错: {str(e)}"
+    if not success:
+        return False, result
+
+    question_rows, student_score = result
+    return to_sql_graded_sheet(
+        creator, class_name, question_rows, student_score, fingerprint
+    )
+
+
+# 逐个导入Excel答题卡，files为skip_imported_files返回的待导入列表
+def import_xlsx_files(files):
+    """依次读取、评分并写入，逐个返回(文件名, 是否成功, 提示信息)"""
+    for file_name, file_path, creator, class_name, fingerprint in files:
+        try:
+            xls_df = read_xlsx(file_path)
+        except Exception as e:
+            yield file_name, False, f"读取失败：{str(e)}"
+            continue
+
+        success, message = to_sql_questions(xls_df, creator, class_name, fingerprint)
+        yield file_name, success, message if success else f"导入失败：{message}"
+
+
+# 并行导入Excel答题卡：先串行导入标准答案，再用进程池读取和评分学生答题卡
+def _get_grading_executor():
+    global _grading_executor
+    with _grading_executor_lock:
+        if _grading_executor is None:
+            methods = multiprocessing.get_all_start_methods()
+            _grading_executor = ProcessPoolExecutor(
+                max_workers=GRADING_WORKERS,
+                mp_context=multiprocessing.get_context(
+                    "forkserver" if "forkserver" in methods else "spawn"
+                ),
+            )
+        return _grading_executor
+
+
+def _reset_grading_executor(executor):
+    """子进程异常退出后进程池不能再用，下次导入时重新创建"""
+    global _grading_executor
+    with _grading_executor_lock:
+        if _grading_executor is executor:
+            _grading_executor = None
+    executor.shutdown(wait=False)
+
+
+def import_xlsx_files_parallel(files):
+    """学生答题卡在子进程中读取和评分，评分结果回到当前进程统一写入数据库"""
+    admin_files = [f for f in files if f[2] == "admin"]
+    student_files = [f for f in files if f[2] != "admin"]
+
+    # 标准答案必须先入库，学生答题卡才能评分
+    yield from import_xlsx_files(admin_files)
+
+    if not student_files:
+        return
+
+    # 进程池大小按CPU核数确定，在所有导入任务之间复用
+    executor = _get_grading_executor()
+    futures = {}
+    for file_name, file_path, creator, class_name, fingerprint in student_files:
+        try:
+            answer_key = get_answer_key(class_name)
+        except Exception as e:
+            answer_key = EMPTY_ANSWER_KEY
+        future = executor.submit(
+            grade_xlsx_file, file_path, creator, class_name, answer_key
+        )
+        futures[future] = (file_name, creator, class_name, fingerprint)
+
+    # 哪个文件先评分完成就先写入
+    for future in as_completed(futures):
+        file_name, creator, class_name, fingerprint = futures[future]
+        try:
+            success, result = future.result()
+        except BrokenProcessPool as e:
+            _reset_grading_executor(executor)
+            yield file_name, False, f"读取失败：{str(e)}"
+            continue
+        except Exception as e:
+            yield file_name, False, f"读取失败：{str(e)}"
+            continue
+        if not success:
+            yield file_name, False, f"导入失败：{result}"
+            continue
+
+        question_rows, student_score = result
+        success, message = to_sql_graded_sheet(
+            creator, class_name, question_rows, student_score, fingerprint
+        )
+        yield file_name, success, message if success else f"导入失败：{message}"
+
+
+# 后台导入任务的线程池，第一次使用时创建
+def _get_import_executor():
+    global _import_executor
+    if _import_executor is None:
+        with _import_executor_lock:
+            if _import_executor is None:
+                _recover_import_jobs_locked()
+                _import_executor = ThreadPoolExecutor(
+                    max_workers=IMPORT_JOB_WORKERS, thread_name_prefix="import-job"
+                )
+    return _import_executor
+
+
+def _recover_import_jobs():
+    """每个进程只执行一次，init_db每次页面重跑都会调用"""
+    if not _interrupted_jobs_marked:
+        with _import_executor_lock:
+            _recover_import_jobs_locked()
+
+
+def _recover_import_jobs_locked():
+    # 进程重启后，上次未完成的任务不会再继续，标记为中止；
+    # 在本进程创建线程池之前执行，不会误标本进程提交的任务
+    global _interrupted_jobs_marked
+    if not _interrupted_jobs_marked and _import_executor is None:
+        _mark_interrupted_jobs()
+        _interrupted_jobs_marked = True
+
+
+def _mark_interrupted_jobs():
+    session = get_session()
+    try:
+        session.query(ImportJob).filter(
+            ImportJob.status.in_(["pending", "running"])
+        ).update(
+            {
+                ImportJob.status: "failed",
+                ImportJob.errors: "服务重启，任务已中断",
+                ImportJob.finished_at: datetime.now(),
+            },
+            synchronize_session=False,
+        )
+        session.commit()
+    except Exception:
+        session.rollback()
+    finally:
+        session.close()
+
+
+def _update_import_job(job_id, **values):
+    session = get_session()
+    try:
+        session.query(ImportJob).filter(ImportJob.id == job_id).update(values)
+        session.commit()
+    finally:
+        session.close()
+
+
+def _finish_import_job(job_id, status, errors):
+    """写入任务的结束状态；任务不能停留在进行中，否则页面会一直刷新等待"""
+    values = dict(status=status, current_file=None, finished_at=datetime.now())
+    try:
+        _update_import_job(job_id, errors="\n".join(errors), **values)
+        return
+    except Exception:
+        pass
+    # 写入失败（例如数据库暂时被锁）时稍后重试，只写结束状态
+    for _ in range(3):
+        time.sleep(1)
+        try:
+            _update_import_job(job_id, **values)
+            return
+        except Exception:
+            continue
+
+
+# 在线程池中执行的导入任务，每导入一个文件更新一次进度
+def _run_import_job(job_id, files, parallel, cleanup):
+    imported_files = []
+    errors = []
+    status = "failed"
+    try:
+        _update_import_job(
+            job_id,
+            status="running",
+            started_at=datetime.now(),
+            current_file=files[0][0] if files else None,
+        )
+        if parallel:
+            import_results = import_xlsx_files_parallel(files)
+        else:
+            import_results = import_xlsx_files(files)
+
+        for file_name, success, message in import_results:
+            if success:
+                imported_files.append(file_name)
+            else:
+                errors.append(f"文件 '{file_name}' {message}")
+            _update_import_job(
+                job_id,
+                succeeded=len(imported_files),
+                failed=len(errors),
+                current_file=file_name,
+                imported_files="\n".join(imported_files),
+                errors="\n".join(errors),
+            )
+        status = "done"
+    except Exception as e:
+        errors.append(f"文件导入时发生未知错误：{str(e)}")
+    finally:
+        _finish_import_job(job_id, status, errors)
+        # 上传的文件保存在临时文件中，导入结束后删除
+        if cleanup:
+            for file_info in files:
+                try:
+                    os.unlink(file_info[1])
+                except OSError:
+                    pass
+
+
+# 提交后台导入任务，files为skip_imported_files返回的待导入列表
+def submit_import_job(files, parallel=False, cleanup=False):
+    """在jobs表中登记任务并交给线程池执行，立即返回任务id"""
+    files = list(files)
+    session = get_session()
+    try:
+        job = ImportJob(status="pending", total=len(files))
+        session.add(job)
+        session.commit()
+        job_id = job.id
+    finally:
+        session.close()
+
+    _get_import_executor().submit(_run_import_job, job_id, files, parallel, cleanup)
+    return job_id
+
+
+# 查询导入任务进度，只读jobs表中的少量行，可以在每次页面重跑时调用
+def get_import_jobs(job_ids=None, active_only=False):
+    """返回任务字典列表，按提交顺序排列"""
+    session = get_session()
+    try:
+        query = session.query(ImportJob)
+        if job_ids is not None:
+            query = query.filter(ImportJob.id.in_(list(job_ids)))
+        if active_only:
+            query = query.filter(ImportJob.status.in_(["pending", "running"]))
+        return [
+            {
+                "id": job.id,
+                "status": job.status,
+                "total": job.total or 0,
+                "succeeded": job.succeeded or 0,
+                "failed": job.failed or 0,
+                "current_file": job.current_file,
+                "imported_files": (job.imported_files or "").splitlines(),
+                "errors": (job.errors or "").splitlines(),
+            }
+            for job in query.order_by(ImportJob.id)
+        ]
+    finally:
+        session.close()
+
+
+# 按数据库中已保存的答案重新评分一个班级
+def regrade_class(class_name, ordinals=None):
+    """全部在数据库中完成，只更新得分确实变化的答题记录，返回(是否成功, 提示信息)
+
+    ordinals为需要重新评分的题目序号（从0开始），为空时检查整个班级的所有题目。
+    学生答题卡可能是按任意一版标准答案评分的（包括重启前的版本），因此默认不做
+    版本比较，由下面的条件只挑出得分与当前标准答案不一致的行，走索引很快。
+    """
+    invalidate_answer_key(class_name)
+    answer_key = get_answer_key(class_name)
+    if len(answer_key.answers) == 0:
+        return False, f"班级 '{class_name}' 没有标准答案"
+
+    if ordinals is None:
+        ordinals = range(len(answer_key.answers))
+    ordinals = sorted(o for o in set(ordinals) if 0 <= o < len(answer_key.answers))
+    if not ordinals:
+        return True, "标准答案没有变化，无需重新评分"
+
+    # 学生答案与标准答案按(班级, 题目序号, 归一化答案)关联，答对得该题分值，否则为0
+    placeholders = ",".join(str(o) for o in ordinals)
+    new_score_sql = (
+        f"coalesce((select k.score from {ANSWER_KEY_SQL} k "
+        "where k.ordinal = q.ordinal and k.normalized_answer = q.normalized_answer), 0)"
+    )
+    changed_rows_sql = (
+        "q.class_name = :class_name and q.creator != 'admin' "
+        f"and q.ordinal in ({placeholders}) "
+        f"and cast(coalesce(q.score, 0) as real) != cast({new_score_sql} as real)"
+    )
+
+    session = get_session()
+    try:
+        params = {"class_name": class_name}
+        # 先找出得分会变化的学生，更新题目分数后只重新汇总这些学生的总分
+        changed_creators = session.execute(
+            text(f"select distinct q.creator from questions q where {changed_rows_sql}"),
+            params,
+        ).scalars().all()
+        question_result = session.execute(
+            text(
+                f"update questions as q set score = {new_score_sql} "
+                f"where {changed_rows_sql}"
+            ),
+            params,
+        )
+        student_count = 0
+        if changed_creators:
+            student_count = _refresh_student_totals(
+                session, class_name, changed_creators
+            )
+        # 得分变化后学生总分也变了，该班级的题目统计需要重新汇总
+        if question_result.rowcount:
+            rebuild_question_stats(session, class_name)
+        session.commit()
+        # 使相关表的查询缓存失效，确保数据立即更新
+        if question_result.rowcount:
+            invalidate_cache("questions")
+        if student_count:
+            invalidate_cache("students")
+        return (
+            True,
+            f"重新评分完成：检查 {len(ordinals)} 道题，更新 {question_result.rowcount} 条答题记录，"
+            f"{student_count} 名学生总分变化",
+        )
+    except Exception as e:
+        session.rollback()
+        return False, f"重新评分时出错: {str(e)}"
+    finally:
+        session.close()
+
+
+def invalidate_cache(table_name):
+    """数据写入后递增该表的版本号，使该表的查询缓存失效"""
+    with _generation_lock:
+        _table_generations[table_name] = _table_generations.get(table_name, 0) + 1
+
+
+def get_table_generation(table_name):
+    """整张表的版本号"""
+    with _generation_lock:
+        return _table_generations.get(table_name, 0)
+
+
 # 读取数据库中的数据
-@st.cache_data(ttl=60)  # 缓存1分钟，减少频繁查询
 def out_sql(table_name):
     """读取数据库表数据，使用缓存提高性能"""
+    return _out_sql(table_name, get_table_generation(table_name))
+
+
+@st.cache_data(ttl=60, max_entries=64)  # 缓存1分钟，减少频繁查询
+def _out_sql(table_name, generation):
     engine = get_engine()
     sql_command = f"select * from {table_name}"
     return pd.read_sql(sql_command, engine)
 
 
-# 读取特定数据
-@st.cache_data(ttl=60)  # 缓存1分钟，减少频繁查询
-def read_data(table_name, clum, creator, class_name):
-    """读取特定条件的数据，使用缓存提高性能"""
-    engine = get_engine()
-    # 使用参数化查询防止SQL注入
-    sql_command = (
-        f"select {clum} from {table_name} where creator = ? and class_name = ?"
+# 分页读取时允许排序的列：只接受ORM模型中定义的表和列，防止SQL注入
+def _check_table_column(table_name, column=None):
+    table = Base.metadata.tables.get(table_name)
+    if table is None:
+        raise ValueError(f"未知的数据表: {table_name}")
+    if column is not None and column not in table.c:
+        raise ValueError(f"数据表 {table_name} 没有列: {column}")
+
+
+# 统计表中的总行数
+def count_rows(table_name):
+    """总行数，缓存键包含该表的版本号"""
+    _check_table_column(table_name)
+    return _count_rows(table_name, get_table_generation(table_name))
+
+
+@st.cache_data(ttl=60, max_entries=64)
+def _count_rows(table_name, generation):
+    with get_engine().connect() as conn:
+        return conn.exec_driver_sql(f"select count(*) from {table_name}").scalar()
+
+
+# 键集分页读取一页数据
+def read_page(table_name, cursor=None, page_size=30, sort_key=None, descending=False):
+    """返回(当前页数据, 下一页游标)，没有下一页时游标为None
+
+    cursor为上一页最后一行的(排序值, id)，为空时读取第一页。按(排序列, id)做
+    键集分页，每一页都走(排序列, id)索引定位，页码再大也不需要跳过前面的行。
+    """
+    _check_table_column(table_name, sort_key)
+    return _read_page(
+        table_name,
+        cursor,
+        page_size,
+        sort_key,
+        descending,
+        get_table_generation(table_name),
     )
-    return pd.read_sql(sql_command, engine, params=(creator, class_name))
 
 
-def clear_cache():
-    """清除所有数据库查询缓存"""
-    # 清除out_sql缓存
-    out_sql.clear()
-    # 清除read_data缓存
-    read_data.clear()
+def _read_page_segment(table_name, sort_key, is_null, direction, bound, params):
+    """读取排序列为空或不为空的那一部分，bound为游标条件，两部分都只走索引范围扫描"""
+    where = f"{sort_key} is null" if is_null else f"{sort_key} is not null"
+    if bound:
+        where += f" and {bound}"
+    return pd.read_sql(
+        text(
+            f"select *, {sort_key} as _sort_value from {table_name} where {where} "
+            f"order by {sort_key} {direction}, id {direction} limit :limit"
+        ),
+        get_engine(),
+        params=params,
+    )
+
+
+@st.cache_data(ttl=60, max_entries=256)
+def _read_page(table_name, cursor, page_size, sort_key, descending, generation):
+    direction = "desc" if descending else "asc"
+    compare = "<" if descending else ">"
+    params = {"limit": page_size + 1}
+    if cursor is not None:
+        params["sort_value"], params["last_id"] = cursor
+
+    if sort_key is None:
+        where = "" if cursor is None else f"where id {compare} :last_id"
+        page = pd.read_sql(
+            text(
+                f"select *, id as _sort_value from {table_name} {where} "
+                f"order by id {direction} limit :limit"
+            ),
+            get_engine(),
+            params=params,
+        )
+    else:
+        # SQLite中空值排在最前（倒序时最后），空值和非空值分成两段分别按索引读取，
+        # 不用coalesce，否则无法使用索引
+        segments = [False, True] if descending else [True, False]
+        if cursor is not None and params["sort_value"] is None:
+            # 游标在空值段中，从空值段继续
+            segments = segments[segments.index(True):]
+            bounds = [f"id {compare} :last_id"]
+        elif cursor is not None:
+            segments = segments[segments.index(False):]
+            bounds = [f"({sort_key}, id) {compare} (:sort_value, :last_id)"]
+        else:
+            bounds = [None]
+        bounds += [None] * (len(segments) - len(bounds))
+
+        page = None
+        for is_null, bound in zip(segments, bounds):
+            part = _read_page_segment(
+                table_name, sort_key, is_null, direction, bound, params
+            )
+            page = part if page is None else pd.concat([page, part], ignore_index=True)
+            params["limit"] = page_size + 1 - len(page)
+            if params["limit"] <= 0:
+                break
+
+    # 多读一行用来判断是否还有下一页
+    next_cursor = None
+    if len(page) > page_size:
+        page = page.iloc[:page_size]
+        last_row = page.iloc[-1]
+        # 转换为Python原生类型，便于作为查询参数和缓存键
+        sort_value = last_row["_sort_value"]
+        if pd.isna(sort_value):
+            sort_value = None
+        elif hasattr(sort_value, "item"):
+            sort_value = sort_value.item()
+        next_cursor = (sort_value, int(last_row["id"]))
+    return page.drop(columns="_sort_value"), next_cursor
+
+
+# 导出整张表为CSV
+def export_csv(table_name):
+    """CSV内容，缓存键包含该表的版本号，数据不变时不重复生成"""
+    _check_table_column(table_name)
+    return _export_csv(table_name, get_table_generation(table_name))
+
+
+@st.cache_data(ttl=600, max_entries=8)
+def _export_csv(table_name, generation):
+    engine = get_engine()
+    return pd.read_sql(f"select * from {table_name}", engine).to_csv().encode("utf_8_sig")
+
+
+# 读取有标准答案的班级
+def list_key_classes():
+    """返回导入过标准答案的班级名称列表"""
+    return _list_key_classes(get_table_generation("questions"))
+
+
+@st.cache_data(ttl=60, max_entries=16)
+def _list_key_classes(generation):
+    with get_engine().connect() as conn:
+        return [
+            row[0]
+            for row in conn.exec_driver_sql(
+                "select distinct class_name from questions "
+                "where creator = 'admin' and class_name is not null order by class_name"
+            )
+        ]
+
+
+# 读取题目分析统计
+def get_question_stats():
+    """返回各班级每道题的作答人数、答对人数、正确率和区分度，随题目数据版本缓存"""
+    return _get_question_stats(get_table_generation("questions"))
+
+
+@st.cache_data(ttl=600, max_entries=16)
+def _get_question_stats(generation):
+    with get_engine().connect() as conn:
+        return pd.read_sql(
+            "select class_name, ordinal, attempts, correct, correct_rate, discrimination "
+            "from question_stats order by class_name, ordinal",
+            conn,
+        )
 
 
 # 清空question数据表中的数据
@@ -300,12 +1224,32 @@ def del_question_data(id):
     session = get_session()
     try:
         if id:
+            question = session.query(Question).filter(Question.id == id).first()
             session.query(Question).filter(Question.id == id).delete()
+            if question is not None:
+                # 答题卡不完整了，重新导入该文件时不能跳过
+                _forget_imports(session, question.class_name, question.creator)
+            if question is not None and question.creator != "admin":
+                _refresh_student_totals(
+                    session, question.class_name, [question.creator]
+                )
+                rebuild_question_stats(session, question.class_name)
         else:
+            question = None
             session.query(Question).delete()
+            session.query(QuestionStat).delete()
+            # 题目全部删除后，导入台账也要清空，以便重新导入
+            session.query(ImportRecord).delete()
         session.commit()
+        # 删除标准答案时，使对应班级的标准答案缓存失效
+        if not id:
+            invalidate_answer_key()
+        elif question is not None and question.creator == "admin":
+            invalidate_answer_key(question.class_name)
+        elif question is not None:
+            invalidate_cache("students")
         # 清除缓存，确保删除后页面立即更新
-        clear_cache()
+        invalidate_cache("questions")
         return True
     except Exception as e:
         session.rollback()
@@ -315,17 +1259,40 @@ def del_question_data(id):
         session.close()
 
 
+# 按答题记录重新汇总学生总分
+def refresh_student_totals(class_name=None):
+    """返回(是否成功, 提示信息)，class_name为空时汇总所有班级"""
+    session = get_session()
+    try:
+        count = _refresh_student_totals(session, class_name)
+        session.commit()
+        if count:
+            invalidate_cache("students")
+        return True, f"已重新汇总学生总分，{count} 名学生总分变化"
+    except Exception as e:
+        session.rollback()
+        return False, f"汇总学生总分时出错: {str(e)}"
+    finally:
+        session.close()
+
+
 # 清空student数据表中的数据
 def del_student_data(id):
     session = get_session()
     try:
         if id:
+            student = session.query(Student).filter(Student.id == id).first()
             session.query(Student).filter(Student.id == id).delete()
+            if student is not None:
+                # 重新导入该学生的答题卡时才能恢复学生记录
+                _forget_imports(session, student.class_name, student.name)
         else:
+            student = None
             session.query(Student).delete()
+            _forget_imports(session)
         session.commit()
         # 清除缓存，确保删除后页面立即更新
-        clear_cache()
+        invalidate_cache("students")
         return True
     except Exception as e:
         session.rollback()
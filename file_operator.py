@@ -1,6 +1,59 @@
+import hashlib
 import os
 import pandas as pd
 import re
+import tempfile
+import threading
+import uuid
+import zipfile
+from collections import OrderedDict
+from functools import lru_cache
+from openpyxl import load_workbook
+
+
+# 答题卡只用到前4列：序号、题目、答案、分数
+ANSWER_SHEET_COLUMNS = 4
+
+# 上传文件时每次读写的块大小
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# 上传过程中临时文件名的前缀，写完后原子重命名为目标文件
+UPLOAD_TEMP_PREFIX = ".upload-"
+
+# 外部存储根目录下按内容去重保存上传文件的目录名，不作为分类显示
+BLOB_STORE_DIR = ".blobs"
+
+# 批量下载的ZIP文件缓存目录和最多保留的个数
+ZIP_CACHE_DIR = os.path.join(tempfile.gettempdir(), "zip_cache")
+ZIP_CACHE_ENTRIES = 8
+
+# 本身已经压缩过的文件格式，打包时直接存储，不再压缩
+STORED_EXTENSIONS = frozenset(
+    [
+        ".xlsx",
+        ".xls",
+        ".docx",
+        ".pptx",
+        ".pdf",
+        ".jpg",
+        ".jpeg",
+        ".png",
+        ".gif",
+        ".webp",
+        ".zip",
+        ".rar",
+        ".7z",
+        ".gz",
+        ".mp3",
+        ".mp4",
+    ]
+)
+
+# (路径, 包内文件名, 大小, 修改时间)元组 -> 已生成的ZIP文件路径，按最近使用顺序排列
+# 只在内存中记录，启动后第一次使用时清空缓存目录中上次运行留下的ZIP文件
+_zip_cache = OrderedDict()
+_zip_cache_purged = False
+_zip_cache_lock = threading.Lock()
 
 
 # 读取当前目录的文件名
@@ -12,13 +65,204 @@ def get_files_name(path):
     return files_list
 
 
+# 分块计算文件的SHA-256，避免一次读入整个文件
+def file_sha256(file_name, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(file_name, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# 按(路径, 大小, 修改时间)缓存已有文件的SHA-256，文件不变时不重复读取
+@lru_cache(maxsize=4096)
+def _cached_file_sha256(file_name, file_size, mtime_ns):
+    return file_sha256(file_name)
+
+
+def cached_file_sha256(file_name):
+    file_stat = os.stat(file_name)
+    return _cached_file_sha256(file_name, file_stat.st_size, file_stat.st_mtime_ns)
+
+
+# 计算文件对象剩余内容的SHA-256，完成后回到原来的位置
+def stream_sha256(stream, chunk_size=UPLOAD_CHUNK_SIZE):
+    position = stream.tell()
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: stream.read(chunk_size), b""):
+        digest.update(chunk)
+    stream.seek(position)
+    return digest.hexdigest()
+
+
+# 把文件对象分块写入目标路径：先写同目录下的临时文件，fsync后原子重命名
+def save_stream(stream, file_name, size=None, chunk_size=UPLOAD_CHUNK_SIZE):
+    """返回(是否写入, SHA-256)；目标文件已存在且内容相同时不写入"""
+    stream.seek(0)
+    # 大小相同时才可能内容相同，先比较校验和，相同就不必写盘
+    if size is not None:
+        try:
+            if os.path.getsize(file_name) == size:
+                sha256 = stream_sha256(stream, chunk_size)
+                if sha256 == cached_file_sha256(file_name):
+                    return False, sha256
+        except OSError:
+            pass
+
+    directory = os.path.dirname(file_name) or "."
+    temp_name = os.path.join(directory, f"{UPLOAD_TEMP_PREFIX}{uuid.uuid4().hex}.tmp")
+    digest = hashlib.sha256()
+    # 与open(..., "wb")相同的权限（受umask影响），O_EXCL保证不会覆盖其他临时文件
+    fd = os.open(temp_name, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in iter(lambda: stream.read(chunk_size), b""):
+                digest.update(chunk)
+                f.write(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_name, file_name)
+    except BaseException:
+        try:
+            os.unlink(temp_name)
+        except OSError:
+            pass
+        raise
+
+    # 同步目录，保证重命名本身也已落盘（部分平台不支持打开目录，忽略即可）
+    try:
+        dir_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+    except OSError:
+        pass
+    return True, digest.hexdigest()
+
+
+# 根据文件扩展名选择ZIP压缩方式
+def zip_compression(file_name):
+    if os.path.splitext(file_name)[1].lower() in STORED_EXTENSIONS:
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+
+def _purge_zip_cache_dir():
+    """在锁内调用，删除缓存目录中不在_zip_cache里的文件（上次运行留下的）"""
+    global _zip_cache_purged
+    os.makedirs(ZIP_CACHE_DIR, exist_ok=True)
+    if _zip_cache_purged:
+        return
+    known = set(_zip_cache.values())
+    for name in os.listdir(ZIP_CACHE_DIR):
+        path = os.path.join(ZIP_CACHE_DIR, name)
+        if path not in known:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+    _zip_cache_purged = True
+
+
+# 把多个文件打包成ZIP，files为(文件路径, 包内文件名)列表
+def build_zip(files):
+    """返回生成的ZIP文件路径；相同文件且都未修改时直接返回上次生成的文件"""
+    key = []
+    for path, arcname in files:
+        file_stat = os.stat(path)
+        key.append((path, arcname, file_stat.st_size, file_stat.st_mtime_ns))
+    key = tuple(key)
+    with _zip_cache_lock:
+        _purge_zip_cache_dir()
+        zip_path = _zip_cache.get(key)
+        if zip_path and os.path.exists(zip_path):
+            _zip_cache.move_to_end(key)
+            return zip_path
+
+    # 打包在锁外进行，不同用户的打包互不阻塞；写到临时文件而不是内存中，完成后再重命名
+    zip_path = os.path.join(ZIP_CACHE_DIR, f"{uuid.uuid4().hex}.zip")
+    temp_path = zip_path + ".tmp"
+    try:
+        with zipfile.ZipFile(temp_path, "w") as zip_file:
+            for path, arcname in files:
+                zip_file.write(path, arcname, compress_type=zip_compression(path))
+        os.replace(temp_path, zip_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+
+    with _zip_cache_lock:
+        stale_paths = []
+        old_path = _zip_cache.pop(key, None)
+        if old_path is not None and old_path != zip_path:
+            # 同样的文件被同时打包了两次，保留后完成的一份
+            stale_paths.append(old_path)
+        _zip_cache[key] = zip_path
+        # 超出数量时删除最久未使用的ZIP文件
+        while len(_zip_cache) > ZIP_CACHE_ENTRIES:
+            stale_paths.append(_zip_cache.popitem(last=False)[1])
+    for path in stale_paths:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+    return zip_path
+
+
+# 与pandas保持一致的单元格取值：空单元格为NaN，整数值的浮点数转为整数
+def _cell_value(value):
+    if value is None:
+        return float("nan")
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+# 流式读取excel文件第一个工作表的前几列，逐行返回（包含表头行）
+def iter_xlsx_rows(file_name, max_columns=ANSWER_SHEET_COLUMNS):
+    # 只读模式不加载样式，values_only只返回单元格的值
+    wb = load_workbook(file_name, read_only=True, data_only=True)
+    try:
+        ws = wb.worksheets[0]
+        # 暂存连续的空行，只有后面还有数据时才返回，与pandas去掉末尾空行的行为一致
+        blank_rows = []
+        for row in ws.iter_rows(max_col=max_columns, values_only=True):
+            if all(value is None for value in row):
+                blank_rows.append(row)
+                continue
+            yield from blank_rows
+            blank_rows = []
+            yield row
+    finally:
+        wb.close()
+
+
 # 读取本地excle文件
-def read_xlsx(file_name):
-    # 传入文件名，读取excle文件
-    xls = pd.ExcelFile(file_name)
+def read_xlsx(file_name, max_columns=ANSWER_SHEET_COLUMNS):
+    # 传入文件名，流式读取excle文件第一个工作表，第一行为表头
+    rows = iter_xlsx_rows(file_name, max_columns)
+    header = next(rows, None)
+    if header is None:
+        return pd.DataFrame()
+
     # 把第一个工作表除第一行外，读作问题信息
-    question = xls.parse(0)
-    return question
+    data = [[_cell_value(value) for value in row] for row in rows]
+
+    # 去掉表头和数据都为空的末尾列
+    width = len(header)
+    while width > 0 and header[width - 1] is None and all(
+        pd.isna(row[width - 1]) for row in data
+    ):
+        width -= 1
+
+    columns = [
+        str(name) if name is not None else f"Unnamed: {index}"
+        for index, name in enumerate(header[:width])
+    ]
+    question = pd.DataFrame([row[:width] for row in data], columns=columns)
+    return question.infer_objects()
 
 
 if __name__ == "__main__":
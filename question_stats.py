@@ -0,0 +1,148 @@
+import math
+
+from sqlalchemy import text
+
+
+# 题目分析统计：按(班级, 题目序号)保存作答人数、答对人数、正确率和区分度
+# 区分度为答对与否和学生总分的点二列相关系数，由下面几个累加量直接算出，
+# 因此导入一张答题卡时只需把它的贡献累加上去，不必重新扫描全部答题记录：
+#   attempts 作答人数，correct 答对人数，
+#   total_sum / total_sq_sum 作答学生总分之和 / 平方和，
+#   correct_total_sum 答对学生的总分之和
+# 题目得分大于0视为答对
+
+CREATE_QUESTION_STATS_SQL = (
+    "create table if not exists question_stats ("
+    "class_name VARCHAR(16) NOT NULL, "
+    "ordinal INTEGER NOT NULL, "
+    "attempts INTEGER NOT NULL DEFAULT 0, "
+    "correct INTEGER NOT NULL DEFAULT 0, "
+    "total_sum FLOAT NOT NULL DEFAULT 0, "
+    "total_sq_sum FLOAT NOT NULL DEFAULT 0, "
+    "correct_total_sum FLOAT NOT NULL DEFAULT 0, "
+    "correct_rate FLOAT, "
+    "discrimination FLOAT, "
+    "PRIMARY KEY (class_name, ordinal))"
+)
+
+_ADD_SHEET_SQL = text(
+    "insert into question_stats (class_name, ordinal, attempts, correct, "
+    "total_sum, total_sq_sum, correct_total_sum) "
+    "values (:class_name, :ordinal, :attempts, :correct, "
+    ":attempts * :total, :attempts * :total * :total, :correct * :total) "
+    "on conflict (class_name, ordinal) do update set "
+    "attempts = attempts + excluded.attempts, "
+    "correct = correct + excluded.correct, "
+    "total_sum = total_sum + excluded.total_sum, "
+    "total_sq_sum = total_sq_sum + excluded.total_sq_sum, "
+    "correct_total_sum = correct_total_sum + excluded.correct_total_sum"
+)
+
+# 从答题记录重新汇总，学生总分按该学生全部题目得分求和
+_REBUILD_SQL = (
+    "insert into question_stats (class_name, ordinal, attempts, correct, "
+    "total_sum, total_sq_sum, correct_total_sum) "
+    "select q.class_name, q.ordinal, count(*), "
+    "sum(q.score > 0), sum(t.total), sum(t.total * t.total), "
+    "sum(case when q.score > 0 then t.total else 0 end) "
+    "from questions q join ("
+    "select class_name, creator, sum(coalesce(score, 0)) as total from questions "
+    "where creator != 'admin' {where} group by class_name, creator"
+    ") t on t.class_name = q.class_name and t.creator = q.creator "
+    "where q.creator != 'admin' and q.ordinal is not null {where_q} "
+    "group by q.class_name, q.ordinal"
+)
+
+
+def discrimination_index(attempts, correct, total_sum, total_sq_sum, correct_total_sum):
+    """由累加量计算点二列相关系数；所有人都答对/答错或总分都相同时无法计算，返回None"""
+    if not attempts:
+        return None
+    p = correct / attempts
+    mean_total = total_sum / attempts
+    total_var = max(total_sq_sum / attempts - mean_total * mean_total, 0.0)
+    denominator = math.sqrt(p * (1 - p) * total_var)
+    if denominator < 1e-12:
+        return None
+    covariance = correct_total_sum / attempts - p * mean_total
+    return covariance / denominator
+
+
+def _refresh_derived(conn, class_name=None):
+    """按累加量重新计算正确率和区分度，只读写该班级的题目统计行"""
+    where = "" if class_name is None else "where class_name = :class_name"
+    rows = conn.execute(
+        text(
+            "select class_name, ordinal, attempts, correct, total_sum, "
+            f"total_sq_sum, correct_total_sum from question_stats {where}"
+        ),
+        {"class_name": class_name},
+    ).fetchall()
+    if not rows:
+        return
+    conn.execute(
+        text(
+            "update question_stats set correct_rate = :correct_rate, "
+            "discrimination = :discrimination "
+            "where class_name = :class_name and ordinal = :ordinal"
+        ),
+        [
+            {
+                "class_name": row[0],
+                "ordinal": row[1],
+                "correct_rate": row[3] / row[2] if row[2] else None,
+                "discrimination": discrimination_index(*row[2:]),
+            }
+            for row in rows
+        ],
+    )
+
+
+def add_sheet_stats(conn, class_name, question_rows, student_score, sign=1):
+    """把一张学生答题卡累加到题目统计中，需要在写入答题卡的同一事务中调用
+
+    sign为-1时减去这张答题卡的贡献，用于学生重新提交时替换旧答题卡。
+    """
+    if student_score is None or not question_rows:
+        return
+    conn.execute(
+        _ADD_SHEET_SQL,
+        [
+            {
+                "class_name": class_name,
+                "ordinal": row["ordinal"],
+                "attempts": sign,
+                "correct": sign * int((row["score"] or 0) > 0),
+                "total": student_score,
+            }
+            for row in question_rows
+        ],
+    )
+    if sign < 0:
+        # 没有人作答的题目不再保留统计行
+        conn.execute(
+            text(
+                "delete from question_stats "
+                "where class_name = :class_name and attempts <= 0"
+            ),
+            {"class_name": class_name},
+        )
+    _refresh_derived(conn, class_name)
+
+
+def rebuild_question_stats(conn, class_name=None):
+    """从答题记录重新汇总题目统计，用于重新评分、删除数据等无法增量更新的情况"""
+    if class_name is None:
+        conn.execute(text("delete from question_stats"))
+        sql = _REBUILD_SQL.format(where="", where_q="")
+    else:
+        conn.execute(
+            text("delete from question_stats where class_name = :class_name"),
+            {"class_name": class_name},
+        )
+        sql = _REBUILD_SQL.format(
+            where="and class_name = :class_name",
+            where_q="and q.class_name = :class_name",
+        )
+    conn.execute(text(sql), {"class_name": class_name})
+    _refresh_derived(conn, class_name)
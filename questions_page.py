@@ -1,20 +1,82 @@
 import streamlit as st
 import pandas as pd
 import os
-import glob
 import tempfile
-
-from aggrid import aggrid_question
+import time
+
+from aggrid import aggrid_question, aggrid_paged
+from storage_catalog import (
+    EXTERNAL_STORAGE_PATH,
+    category_exists,
+    list_files,
+    refresh_category,
+)
+from file_operator import file_sha256
 from db_operator import (
-    out_sql,
+    count_rows,
+    export_csv,
+    list_key_classes,
     del_question_data,
-    to_sql_questions,
-    read_xlsx,
+    submit_import_job,
+    get_import_jobs,
+    get_import_ledger,
+    skip_imported_files,
+    regrade_class,
+    get_question_stats,
 )
 
 
+# 外部存储中存放答题卡的分类目录
+ANSWER_SHEET_CATEGORY = "文档"
+
+# 有导入任务在进行时，页面自动刷新进度的间隔（秒）
+IMPORT_POLL_INTERVAL = 1
+
+
+# 显示后台导入任务的进度，返回是否还有未完成的任务
+def show_import_jobs():
+    # 本会话提交的任务，加上其他会话正在进行的任务
+    job_ids = set(st.session_state.import_job_ids)
+    jobs = {job["id"]: job for job in get_import_jobs(active_only=True)}
+    jobs.update({job["id"]: job for job in get_import_jobs(job_ids)})
+    if not jobs:
+        return False
+
+    st.subheader("⏳ 导入任务")
+    running = False
+    for job_id in sorted(jobs):
+        job = jobs[job_id]
+        finished = job["succeeded"] + job["failed"]
+        if job["status"] in ("pending", "running"):
+            running = True
+            st.progress(
+                finished / job["total"] if job["total"] else 0.0,
+                text=f"任务{job_id}：{finished} / {job['total']}"
+                + (f"，正在导入 {job['current_file']}" if job["current_file"] else ""),
+            )
+            continue
+
+        # 已结束的任务只显示本会话提交的
+        if job_id not in job_ids:
+            continue
+        st.session_state.processed_files.update(job["imported_files"])
+        if job["succeeded"]:
+            st.success(f"🎉 任务{job_id}：成功导入 {job['succeeded']} 个文件")
+            # 如果有admin文件，给出特殊提示
+            if any("admin" in f.lower() for f in job["imported_files"]):
+                st.info("🚨 注意：已导入标准答案文件")
+        for error_msg in job["errors"]:
+            st.error(error_msg)
+
+    if not running and st.button("🧹 清除已完成的任务"):
+        st.session_state.import_job_ids = []
+        st.experimental_rerun()
+    return running
+
+
 # 显示文件导入功能（移除了模板下载和查看命名示例）
 def show_file_import_section():
+    """返回是否还有未完成的导入任务"""
     # 初始化会话状态
     if "processed_files" not in st.session_state:
         st.session_state.processed_files = set()
@@ -28,25 +90,35 @@ def show_file_import_section():
     # 添加file_uploader的key状态跟踪
     if "local_file_uploader_key" not in st.session_state:
         st.session_state.local_file_uploader_key = 0
+    # 本会话提交的后台导入任务
+    if "import_job_ids" not in st.session_state:
+        st.session_state.import_job_ids = []
 
     # 侧边栏 - 文件导入功能（移除了模板下载和查看命名示例）
     with st.sidebar:
         st.header("📋题目管理")
 
+        # 导入在后台线程中进行，这里只显示进度
+        jobs_running = show_import_jobs()
+
         # 使用外部存储路径读取Excel文件
-        external_storage_dir = "/external_storage/文档"
+        external_storage_dir = os.path.join(EXTERNAL_STORAGE_PATH, ANSWER_SHEET_CATEGORY)
 
-        # 检查外部存储目录是否存在
-        if not os.path.exists(external_storage_dir):
+        # 检查外部存储目录是否存在（读取文件索引，不访问磁盘）
+        if not category_exists(ANSWER_SHEET_CATEGORY):
             st.error(f"❌ 外部存储目录不存在: {external_storage_dir}")
             st.info("请确保docker-compose.yml中已正确配置外部存储挂载")
-            return
+            return jobs_running
 
         # 从外部存储目录读取Excel文件
         st.subheader("📤 外部存储文件导入")
 
-        # 获取外部存储目录中的Excel文件
-        external_files = glob.glob(os.path.join(external_storage_dir, "*.xlsx"))
+        # 从文件索引获取外部存储目录中的Excel文件名
+        external_files = [
+            entry.name
+            for entry in list_files(ANSWER_SHEET_CATEGORY)
+            if entry.name.endswith(".xlsx") and not entry.name.startswith(".")
+        ]
 
         if external_files:
             st.info(
@@ -64,9 +136,7 @@ def show_file_import_section():
                     st.session_state.select_all = not st.session_state.select_all
                     # 更新选择的文件列表
                     if st.session_state.select_all:
-                        st.session_state.selected_files = [
-                            os.path.basename(f) for f in external_files
-                        ]
+                        st.session_state.selected_files = list(external_files)
                     else:
                         st.session_state.selected_files = []
 
@@ -74,6 +144,8 @@ def show_file_import_section():
                 if st.button("🔄 刷新文件列表"):
                     # 清理processed_files状态以避免死循环
                     st.session_state.processed_files = set()
+                    # 重新扫描目录，更新文件索引
+                    refresh_category(ANSWER_SHEET_CATEGORY)
                     st.experimental_rerun()
 
             # 显示文件列表供用户选择
@@ -83,7 +155,7 @@ def show_file_import_section():
 
             selected_files = st.multiselect(
                 "选择要导入的文件",
-                [os.path.basename(f) for f in external_files],
+                external_files,
                 default=st.session_state.selected_files,
                 help="选择外部存储目录中的Excel文件进行导入",
                 key="file_selector",
@@ -93,7 +165,6 @@ def show_file_import_section():
             st.session_state.selected_files = selected_files
 
             # 检查是否有新文件需要处理
-            new_files_processed = False
             error_messages = []
 
             if selected_files:
@@ -110,67 +181,54 @@ def show_file_import_section():
                     # 非全选状态保持原有顺序
                     ordered_files = selected_files
 
-                # 按照排序后的顺序处理文件
+                # 按照排序后的顺序解析文件名，收集待导入的文件
+                pending_files = []
                 for file_name in ordered_files:
-                    file_path = os.path.join(external_storage_dir, file_name)
-                    if file_name not in st.session_state.processed_files:
-                        try:
-                            # 根据文件名，获取班别名
-                            try:
-                                class_name = file_name.split(".")[0].split("_")[-2]
-                                # 根据文件名，获取创建者
-                                creator = file_name.split(".")[0].split("_")[-1]
-                            except IndexError:
-                                error_messages.append(
-                                    f"文件 '{file_name}' 命名格式不正确，请按照'班别_姓名.xlsx'格式命名"
-                                )
-                                continue
-
-                            # 读取外部存储Excel文件
-                            try:
-                                df = read_xlsx(file_path)
-                            except Exception as e:
-                                error_messages.append(
-                                    f"文件 '{file_name}' 读取失败：{str(e)}"
-                                )
-                                continue
-
-                            # 数据导入数据库
-                            success, message = to_sql_questions(df, creator, class_name)
-
-                            if success:
-                                # 标记文件为已处理
-                                st.session_state.processed_files.add(file_name)
-                                new_files_processed = True
-                                st.success(f"✅ 成功导入: {file_name}")
-
-                                # 如果是admin文件，给出特殊提示
-                                if "admin" in file_name.lower():
-                                    st.info(
-                                        "🚨 注意：已优先导入标准答案文件，请等待其他文件继续导入..."
-                                    )
-                            else:
-                                error_messages.append(
-                                    f"文件 '{file_name}' 导入失败：{message}"
-                                )
-
-                        except Exception as e:
-                            error_messages.append(
-                                f"文件 '{file_name}' 处理时发生未知错误：{str(e)}"
-                            )
+                    if file_name in st.session_state.processed_files:
+                        continue
+                    # 根据文件名，获取班别名和创建者
+                    try:
+                        class_name = file_name.split(".")[0].split("_")[-2]
+                        creator = file_name.split(".")[0].split("_")[-1]
+                    except IndexError:
+                        error_messages.append(
+                            f"文件 '{file_name}' 命名格式不正确，请按照'班别_姓名.xlsx'格式命名"
+                        )
+                        continue
+                    pending_files.append(
+                        (
+                            file_name,
+                            os.path.join(external_storage_dir, file_name),
+                            creator,
+                            class_name,
+                        )
+                    )
+
+                # 根据导入台账跳过内容未变化的文件，未变化时只需要stat
+                pending_files, skipped_files = skip_imported_files(pending_files)
+                if skipped_files:
+                    st.session_state.processed_files.update(skipped_files)
+                    st.info(f"ℹ️ 已跳过 {len(skipped_files)} 个已导入且未修改的文件")
+
+                # 提交后台导入任务，全选时并行导入：标准答案先导入，学生答题卡交给进程池评分
+                if pending_files:
+                    job_id = submit_import_job(
+                        pending_files, parallel=st.session_state.select_all
+                    )
+                    st.session_state.import_job_ids.append(job_id)
+                    # 已提交的文件不再重复提交，导入失败的可以刷新文件列表后重试
+                    st.session_state.processed_files.update(
+                        file_info[0] for file_info in pending_files
+                    )
+                    # 重置全选状态
+                    st.session_state.select_all = False
+                    # 重新加载页面以显示任务进度
+                    st.experimental_rerun()
 
             # 显示错误消息
             if error_messages:
                 for error_msg in error_messages:
                     st.error(error_msg)
-
-            # 显示导入状态
-            if new_files_processed:
-                st.success("🎉 所选文件已成功导入！")
-                # 重置全选状态
-                st.session_state.select_all = False
-                # 重新加载页面以反映更改
-                st.experimental_rerun()
         else:
             st.warning(
                 f"⚠️ 在 {external_storage_dir} 目录中未找到Excel文件，请将答题卡文件放入该目录"
@@ -203,8 +261,10 @@ def show_file_import_section():
 
         # 处理上传的文件
         if uploaded_files:
-            local_files_processed = False
+            local_pending_files = []
             local_error_messages = []
+            # 读取导入台账，跳过内容相同的已导入文件
+            import_ledger = get_import_ledger()
 
             for uploaded_file in uploaded_files:
                 try:
@@ -232,36 +292,26 @@ def show_file_import_section():
                         tmp_file.write(uploaded_file.getvalue())
                         tmp_file_path = tmp_file.name
 
-                    # 读取上传的Excel文件
-                    try:
-                        df = read_xlsx(tmp_file_path)
-                    except Exception as e:
-                        local_error_messages.append(
-                            f"文件 '{file_name}' 读取失败：{str(e)}"
-                        )
-                        # 清理临时文件
+                    # 内容与台账记录一致时跳过，不再解析
+                    sha256 = file_sha256(tmp_file_path)
+                    record = import_ledger.get(file_name)
+                    if record and record[2] == sha256:
                         os.unlink(tmp_file_path)
-                        continue
-
-                    # 数据导入数据库
-                    success, message = to_sql_questions(df, creator, class_name)
-
-                    # 清理临时文件
-                    os.unlink(tmp_file_path)
-
-                    if success:
-                        # 标记文件为已处理
                         st.session_state.processed_local_files.add(file_name)
-                        local_files_processed = True
-                        st.success(f"✅ 成功导入: {file_name}")
-
-                        # 如果是admin文件，给出特殊提示
-                        if "admin" in file_name.lower():
-                            st.info("🚨 注意：已导入标准答案文件")
-                    else:
-                        local_error_messages.append(
-                            f"文件 '{file_name}' 导入失败：{message}"
-                        )
+                        st.info(f"ℹ️ 文件 '{file_name}' 已导入且内容未修改，已跳过")
+                        continue
+                    fingerprint = {
+                        "file_name": file_name,
+                        "file_size": uploaded_file.size,
+                        "mtime": None,
+                        "sha256": sha256,
+                    }
+
+                    # 临时文件交给后台导入任务，导入结束后由任务删除
+                    local_pending_files.append(
+                        (file_name, tmp_file_path, creator, class_name, fingerprint)
+                    )
+                    st.session_state.processed_local_files.add(file_name)
 
                 except Exception as e:
                     local_error_messages.append(
@@ -273,26 +323,65 @@ def show_file_import_section():
                 for error_msg in local_error_messages:
                     st.error(error_msg)
 
-            # 显示本地文件上传状态
-            if local_files_processed:
-                st.success("🎉 上传的文件已成功导入！")
+            # 提交后台导入任务，标准答案排在前面先导入
+            if local_pending_files:
+                local_pending_files.sort(key=lambda file_info: file_info[2] != "admin")
+                job_id = submit_import_job(local_pending_files, cleanup=True)
+                st.session_state.import_job_ids.append(job_id)
                 # 重置file_uploader状态
                 st.session_state.local_file_uploader_key += 1
                 # 清理已处理文件记录
                 st.session_state.processed_local_files = set()
-                # 重新加载页面以反映更改
+                # 重新加载页面以显示任务进度
                 st.experimental_rerun()
 
+    return jobs_running
+
+
+# 显示题目分析：每道题的正确率和区分度
+def show_question_stats():
+    stats_df = get_question_stats()
+    if stats_df.empty:
+        return
+
+    with st.expander("📊 题目分析"):
+        class_name = st.selectbox(
+            "选择班级",
+            stats_df["class_name"].unique(),
+            key="question_stats_class_selector",
+        )
+        class_stats = stats_df[stats_df["class_name"] == class_name]
+        st.dataframe(
+            pd.DataFrame(
+                {
+                    "题号": class_stats["ordinal"] + 1,
+                    "作答人数": class_stats["attempts"],
+                    "答对人数": class_stats["correct"],
+                    "正确率": class_stats["correct_rate"],
+                    "区分度": class_stats["discrimination"],
+                }
+            ),
+            hide_index=True,
+            column_config={
+                "正确率": st.column_config.ProgressColumn(
+                    "正确率", format="%.2f", min_value=0, max_value=1
+                ),
+                "区分度": st.column_config.NumberColumn("区分度", format="%.2f"),
+            },
+        )
+        st.caption("区分度为答对与否和学生总分的相关系数，越低说明该题越不能区分学生水平")
+
 
 # 显示content内容
-def show_content(question_df):
+def show_content(question_count):
+    """返回是否还有未完成的导入任务"""
     # 显示文件导入功能
-    show_file_import_section()
+    jobs_running = show_file_import_section()
 
     # 侧边栏 - 操作功能
     with st.sidebar:
         # 只有在题目不为空时才显示删除和导出功能
-        if not question_df.empty:
+        if question_count:
             # 由于st.form不能在sidebar中使用，我们改用st.button
             if st.button("删除所有题目"):
                 if del_question_data(id=0):
@@ -302,11 +391,8 @@ def show_content(question_df):
                 else:
                     st.error("❌ 删除失败！")
 
-            @st.cache_data
-            def convert_df(question_df):
-                return question_df.to_csv().encode("utf_8_sig")
-
-            csv = convert_df(question_df)
+            # 导出内容按数据版本缓存，数据不变时不重复读取整张表
+            csv = export_csv("questions")
 
             st.download_button(
                 label="📥 导出题目详情为CSV",
@@ -314,6 +400,20 @@ def show_content(question_df):
                 file_name="题目详情.csv",
                 mime="text/csv",
             )
+
+            # 标准答案修改后，按数据库中已保存的学生答案重新评分
+            key_classes = list_key_classes()
+            if key_classes:
+                st.subheader("🔁 重新评分")
+                regrade_class_name = st.selectbox(
+                    "选择班级", key_classes, key="regrade_class_selector"
+                )
+                if st.button("按当前标准答案重新评分"):
+                    success, message = regrade_class(regrade_class_name)
+                    if success:
+                        st.success(f"✅ {message}")
+                    else:
+                        st.error(f"❌ {message}")
         else:
             st.info("暂无题目数据可操作")
 
@@ -358,24 +458,44 @@ def show_content(question_df):
             st.image("images/2.png", "表内容样例-红色内容不能修改")
 
     # 主内容区域 - 显示题目数据表格
-    if not question_df.empty:
-        # aggrid控件显示题目数据
-        grid_res = aggrid_question(question_df)
+    if question_count:
+        # aggrid控件分页显示题目数据，每次只读取当前页
+        grid_res = aggrid_paged(
+            "questions",
+            aggrid_question,
+            sort_columns={
+                "id": "序号",
+                "class_name": "班级名称",
+                "creator": "创建者",
+                "score": "分数",
+                "add_time": "添加时间",
+            },
+        )
 
         # 如果需要单独删除某些选中的题目，可以在这里添加额外的逻辑
         # 但由于我们已经将删除所有题目的功能移到了侧边栏，这里主要只用于显示
 
+        # 题目分析，读取导入时已汇总好的统计，不扫描答题记录
+        show_question_stats()
+
     else:
         st.error("❌ 题目为空！请先导入数据。")
 
+    return jobs_running
+
 
 def main():
-    # 从数据库获取，题目信息
-    question_df = out_sql("questions")
-    student_df = out_sql("students")
+    # 从数据库获取题目数量，题目数据在表格中分页读取
+    question_count = count_rows("questions")
 
     # 显示content页（已集成文件导入功能）
-    show_content(question_df)
+    jobs_running = show_content(question_count)
+
+    # 有导入任务在进行时，页面渲染完成后稍等片刻重跑以刷新进度；
+    # 期间点击其他控件会立即打断等待
+    if jobs_running:
+        time.sleep(IMPORT_POLL_INTERVAL)
+        st.experimental_rerun()
 
 
 if __name__ == "__main__":
@@ -1,21 +1,23 @@
 import streamlit as st
 import pandas as pd
 
-from aggrid import aggrid_student
+from aggrid import aggrid_student, aggrid_paged
 from db_operator import (
-    out_sql,
+    count_rows,
+    export_csv,
     del_student_data,
+    refresh_student_totals,
 )
 
 
 # 显示content内容
-def show_content(student_df):
+def show_content(student_count):
     # 侧边栏 - 页面标题和功能按钮
     with st.sidebar:
         st.subheader("📊 学生成绩汇总")
 
         # 只有在学生数据不为空时才显示删除和导出功能
-        if not student_df.empty:
+        if student_count:
             # 由于st.form不能在sidebar中使用，我们改用st.button
             if st.button("删除所有学生"):
                 if del_student_data(id=0):
@@ -25,11 +27,8 @@ def show_content(student_df):
                 else:
                     st.error("❌ 删除失败！")
 
-            @st.cache_data
-            def convert_df(student_df):
-                return student_df.to_csv().encode("utf_8_sig")
-
-            csv = convert_df(student_df)
+            # 导出内容按数据版本缓存，数据不变时不重复读取整张表
+            csv = export_csv("students")
 
             st.download_button(
                 label="📥 导出学生总分为CSV",
@@ -37,13 +36,30 @@ def show_content(student_df):
                 file_name="学生总分.csv",
                 mime="text/csv",
             )
+
+            # 学生总分由答题记录汇总得到，答题记录被修改后可以手动重新汇总
+            if st.button("🔄 按答题记录重新汇总总分"):
+                success, message = refresh_student_totals()
+                if success:
+                    st.success(f"✅ {message}")
+                else:
+                    st.error(f"❌ {message}")
         else:
             st.info("暂无学生数据可操作")
 
     # 主内容区域 - 显示学生数据表格
-    if not student_df.empty:
-        # aggrid控件显示学生数据
-        grid_res = aggrid_student(student_df)
+    if student_count:
+        # aggrid控件分页显示学生数据，每次只读取当前页
+        grid_res = aggrid_paged(
+            "students",
+            aggrid_student,
+            sort_columns={
+                "id": "序号",
+                "class_name": "班级名称",
+                "name": "姓名",
+                "score": "分数",
+            },
+        )
 
         # 如果需要单独删除某些选中的学生，可以在这里添加额外的逻辑
         # 但由于我们已经将删除所有学生的功能移到了侧边栏，这里主要只用于显示
@@ -53,11 +69,11 @@ def show_content(student_df):
 
 
 def main():
-    # 从数据库获取，学生信息
-    student_df = out_sql("students")
+    # 从数据库获取学生数量，学生数据在表格中分页读取
+    student_count = count_rows("students")
 
     # 显示content页
-    show_content(student_df)
+    show_content(student_count)
 
 
 if __name__ == "__main__":
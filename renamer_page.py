@@ -5,44 +5,29 @@ import streamlit as st
 import zipfile
 from datetime import datetime
 from utils import chinese_sort_key  # 从utils模块导入排序函数
-
-
-# 添加中文排序函数
-def chinese_sort_key(filename):
-    """
-    为中文文件名生成排序键，支持数字自然排序和汉字拼音排序
-    """
-    # 移除文件扩展名，获取完整的文件名（不含扩展名）
-    name_without_ext = os.path.splitext(filename)[0]
-
-    # 使用正则表达式将文件名分割为数字和非数字部分
-    import re
-
-    parts = re.split(r"(\d+)", name_without_ext)
-
-    # 处理每个部分，将数字转换为数值，非数字部分进行拼音转换
-    sort_key = []
-    for part in parts:
-        if part.isdigit():
-            # 数字部分转换为整数，确保数值比较（1 < 2 < 10）
-            sort_key.append(int(part))
-        else:
-            # 非数字部分进行拼音转换
-            try:
-                from pypinyin import pinyin, Style
-
-                pinyin_list = []
-                for item in pinyin(part, style=Style.NORMAL):
-                    if item:
-                        pinyin_list.append(item[0].lower())
-                # 将拼音列表转换为字符串，确保可比较
-                sort_key.append("".join(pinyin_list))
-            except ImportError:
-                # 如果没有安装pypinyin，使用Unicode编码进行简单排序
-                sort_key.append(part.lower())
-
-    # 返回一个元组，确保所有元素都是可比较的类型
-    return tuple(sort_key)
+from storage_catalog import (
+    EXTERNAL_STORAGE_PATH,
+    ROOT_CATEGORY,
+    category_exists,
+    list_categories,
+    list_files,
+    refresh_category,
+)
+
+# 支持重命名的文件类型
+SUPPORTED_EXTENSIONS = [
+    ".xlsx",
+    ".xls",
+    ".jpg",
+    ".jpeg",
+    ".png",
+    ".gif",
+    ".bmp",
+    ".py",
+    ".txt",
+    ".csv",
+    ".pdf",
+]
 
 
 def extract_name_from_filename(
@@ -151,6 +136,7 @@ def rename_files_in_directory(
     custom_rule="",
     rename_list=None,
     preview_only=True,
+    files=None,
 ):
     """
         重命名目录中的文件
@@ -164,36 +150,24 @@ def rename_files_in_directory(
             custom_rule: 自定义重命名规则
             rename_list: 重命名名称列表
     preview_only: 是否仅预览而不实际重命名
+            files: 已排好序的文件名列表，为空时读取源目录
 
         Returns:
             list: 包含原始文件名和新文件名的元组列表
     """
     renamed_files = []
 
-    # 支持的文件类型
-    supported_extensions = [
-        ".xlsx",
-        ".xls",
-        ".jpg",
-        ".jpeg",
-        ".png",
-        ".gif",
-        ".bmp",
-        ".py",
-        ".txt",
-        ".csv",
-        ".pdf",
-    ]
-
-    # 获取文件列表并按中文文件名排序
-    files = [
-        f
-        for f in os.listdir(source_dir)
-        if os.path.splitext(f)[1].lower() in supported_extensions and f != ".DS_Store"
-    ]
-
-    # 按中文文件名排序（汉字按字母顺序）
-    files = sorted(files, key=chinese_sort_key)
+    if files is None:
+        # 获取文件列表并按中文文件名排序
+        files = [
+            f
+            for f in os.listdir(source_dir)
+            if os.path.splitext(f)[1].lower() in SUPPORTED_EXTENSIONS
+            and f != ".DS_Store"
+        ]
+
+        # 按中文文件名排序（汉字按字母顺序）
+        files = sorted(files, key=chinese_sort_key)
 
     # 遍历源目录中的所有文件
     for i, filename in enumerate(files):
@@ -365,21 +339,8 @@ def show_file_rename_page():
     # 从本地文件夹读取文件
     st.subheader("选择文件目录")
 
-    # 外部存储路径（从环境变量获取或使用默认路径）
-    EXTERNAL_STORAGE_PATH = os.getenv("EXTERNAL_STORAGE_PATH", "/external_storage")
-
-    # 获取/external_storage目录下的所有子目录
-    available_dirs = []
-    if os.path.exists(EXTERNAL_STORAGE_PATH) and os.path.isdir(EXTERNAL_STORAGE_PATH):
-        available_dirs = [
-            d
-            for d in os.listdir(EXTERNAL_STORAGE_PATH)
-            if os.path.isdir(os.path.join(EXTERNAL_STORAGE_PATH, d))
-        ]
-        available_dirs = sorted(available_dirs)
-
-    # 添加根目录选项
-    available_dirs.insert(0, "根目录")
+    # 从文件索引获取/external_storage目录下的所有子目录（已排序），并添加根目录选项
+    available_dirs = ["根目录"] + list_categories()
 
     # 选择目录
     selected_dir_option = st.selectbox(
@@ -390,10 +351,12 @@ def show_file_rename_page():
         key="directory_selector",
     )
 
-    # 确定实际路径
+    # 确定实际路径和在文件索引中的分类
     if selected_dir_option == "根目录":
+        selected_category = ROOT_CATEGORY
         local_folder_path = EXTERNAL_STORAGE_PATH
     else:
+        selected_category = selected_dir_option
         local_folder_path = os.path.join(EXTERNAL_STORAGE_PATH, selected_dir_option)
 
     # st.info(f"当前选择的目录: {local_folder_path}")
@@ -408,36 +371,15 @@ def show_file_rename_page():
     else:
         st.session_state.dir_changed = False
 
-    if (
-        local_folder_path
-        and os.path.exists(local_folder_path)
-        and os.path.isdir(local_folder_path)
-    ):
-        # 获取文件夹中的文件
-        supported_extensions = [
-            ".xlsx",
-            ".xls",
-            ".jpg",
-            ".jpeg",
-            ".png",
-            ".gif",
-            ".bmp",
-            ".py",
-            ".txt",
-            ".csv",
-            ".pdf",
-        ]
-
+    if category_exists(selected_category):
+        # 从文件索引获取文件夹中的文件，已按中文文件名排序
         files = [
-            f
-            for f in os.listdir(local_folder_path)
-            if os.path.isfile(os.path.join(local_folder_path, f))
-            and os.path.splitext(f)[1].lower() in supported_extensions
+            entry.name
+            for entry in list_files(selected_category)
+            if os.path.splitext(entry.name)[1].lower() in SUPPORTED_EXTENSIONS
         ]
 
         if files:
-            # 按中文文件名排序
-            files = sorted(files, key=chinese_sort_key)
 
             # 预览重命名结果
             # 即使目录未改变也重新生成预览数据，确保显示最新内容
@@ -450,6 +392,7 @@ def show_file_rename_page():
                 custom_rule=custom_rule,
                 rename_list=rename_list,
                 preview_only=True,
+                files=files,
             )
 
             if renamed_files:
@@ -501,7 +444,10 @@ def show_file_rename_page():
                                 custom_rule=custom_rule,
                                 rename_list=rename_list,
                                 preview_only=False,  # 实际执行重命名
+                                files=files,
                             )
+                            # 重命名后重新扫描该目录，更新文件索引
+                            refresh_category(selected_category)
 
                             if actual_renamed_files:
                                 # 更新预览数据中的状态
@@ -528,15 +474,11 @@ def show_file_rename_page():
 
                                 # 显示重命名后的文件列表
                                 new_files = [
-                                    f
-                                    for f in os.listdir(local_folder_path)
-                                    if os.path.isfile(
-                                        os.path.join(local_folder_path, f)
-                                    )
-                                    and os.path.splitext(f)[1].lower()
-                                    in supported_extensions
+                                    entry.name
+                                    for entry in list_files(selected_category)
+                                    if os.path.splitext(entry.name)[1].lower()
+                                    in SUPPORTED_EXTENSIONS
                                 ]
-                                new_files = sorted(new_files, key=chinese_sort_key)
                             else:
                                 st.warning("没有找到有效的文件进行重命名。")
 
@@ -566,6 +508,7 @@ def show_file_rename_page():
                             custom_rule=custom_rule,
                             rename_list=rename_list,
                             preview_only=False,
+                            files=files,
                         )
 
                         if actual_renamed_files:
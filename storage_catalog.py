@@ -0,0 +1,413 @@
+import os
+import threading
+import time
+from collections import namedtuple
+
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from db_operator import StorageFile, get_engine
+from file_operator import BLOB_STORE_DIR, UPLOAD_TEMP_PREFIX
+from utils import chinese_sort_key
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+    from watchdog.observers.polling import PollingObserver
+except ImportError:
+    # 没有安装watchdog时只靠定期全量扫描和页面写入后的主动刷新保持索引最新
+    FileSystemEventHandler = object
+    Observer = PollingObserver = None
+
+
+# 外部存储路径（从环境变量获取或使用默认路径）
+EXTERNAL_STORAGE_PATH = os.getenv("EXTERNAL_STORAGE_PATH", "/external_storage")
+
+# 网络存储（NAS）上收不到inotify事件时，设置CATALOG_POLLING=1改用轮询方式监视
+CATALOG_POLLING = os.getenv("CATALOG_POLLING", "") == "1"
+
+# 轮询方式下两次检查之间的间隔（秒）；每次检查都要stat整个目录树，不宜过短
+CATALOG_POLL_INTERVAL = int(os.getenv("CATALOG_POLL_INTERVAL", "60"))
+
+# 内存中变化的条目写回SQLite的间隔（秒）
+CATALOG_FLUSH_INTERVAL = 2
+
+# 全量扫描的间隔（秒），用于补上监视期间漏掉的变化
+CATALOG_RESCAN_INTERVAL = int(os.getenv("CATALOG_RESCAN_INTERVAL", "600"))
+
+# 根目录下的文件所在的分类名
+ROOT_CATEGORY = ""
+
+# 文件索引条目，sort_key为预先计算好的中文排序键
+FileEntry = namedtuple(
+    "FileEntry", ["category", "name", "path", "size", "mtime", "sort_key"]
+)
+
+
+# 外部存储目录的文件索引：分类 -> {文件名: FileEntry}，只索引根目录和分类目录下的文件
+_catalog = {}
+# 按排序键排好序的文件列表和分类列表，索引变化时置空，下次读取时重新生成
+_sorted_files = {}
+_sorted_categories = None
+# 待写回SQLite的变化：(分类, 文件名) -> FileEntry，值为None表示已删除
+_dirty = {}
+_catalog_lock = threading.RLock()
+_catalog_root = None
+_catalog_ready = False
+# 启动过程（读取持久化的索引或首次全量扫描）在这个锁内完成，其他会话等待启动完成
+_start_lock = threading.RLock()
+_observer = None
+_stop_event = threading.Event()
+
+
+def _split_path(path):
+    """把外部存储下的路径拆成(分类, 文件名)；不在索引范围内时返回None"""
+    relative = os.path.relpath(path, _catalog_root)
+    if relative == "." or relative.startswith(".."):
+        return None
+    parts = relative.split(os.sep)
+    # 上传过程中的临时文件和去重存储目录不进入索引
+    if parts[-1].startswith(UPLOAD_TEMP_PREFIX) or parts[0] == BLOB_STORE_DIR:
+        return None
+    if len(parts) == 1:
+        return ROOT_CATEGORY, parts[0]
+    if len(parts) == 2:
+        return parts[0], parts[1]
+    return None
+
+
+def _make_entry(category, name, size, mtime):
+    path = os.path.join(_catalog_root, category, name)
+    return FileEntry(category, name, path, size, mtime, chinese_sort_key(name))
+
+
+def _set_entry(category, name, entry):
+    """在锁内修改索引并记录待写回的变化，entry为None表示删除"""
+    files = _catalog.get(category)
+    if entry is None:
+        if files is None or files.pop(name, None) is None:
+            return
+    else:
+        if files is None:
+            files = _catalog[category] = {}
+            _add_category_marker(category)
+        if files.get(name) == entry:
+            return
+        files[name] = entry
+    _dirty[(category, name)] = entry
+    _sorted_files.pop(category, None)
+
+
+def _add_category_marker(category):
+    global _sorted_categories
+    if category != ROOT_CATEGORY:
+        _dirty[(category, "")] = _make_entry(category, "", None, None)
+        _sorted_categories = None
+
+
+def _remove_category(category):
+    global _sorted_categories
+    files = _catalog.pop(category, None)
+    if files is None:
+        return
+    for name in files:
+        _dirty[(category, name)] = None
+    _dirty[(category, "")] = None
+    _sorted_files.pop(category, None)
+    _sorted_categories = None
+
+
+def _scan_directory(directory):
+    """返回目录下的{文件名: (大小, 修改时间)}和子目录名列表"""
+    files = {}
+    subdirectories = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if (
+                entry.name.startswith(UPLOAD_TEMP_PREFIX)
+                or entry.name == BLOB_STORE_DIR
+            ):
+                continue
+            try:
+                if entry.is_dir():
+                    subdirectories.append(entry.name)
+                elif entry.is_file():
+                    stat = entry.stat()
+                    files[entry.name] = (stat.st_size, stat.st_mtime)
+            except OSError:
+                # 扫描过程中被删除的文件
+                continue
+    return files, subdirectories
+
+
+def _apply_scan(category, scanned):
+    """用扫描结果替换一个分类的索引"""
+    with _catalog_lock:
+        if category not in _catalog:
+            _catalog[category] = {}
+            _add_category_marker(category)
+        old_names = set(_catalog[category]) - set(scanned)
+        for name in old_names:
+            _set_entry(category, name, None)
+        for name, (size, mtime) in scanned.items():
+            _set_entry(category, name, _make_entry(category, name, size, mtime))
+
+
+def refresh_category(category):
+    """重新扫描一个分类目录，目录不存在时从索引中删除"""
+    _ensure_started()
+    directory = os.path.join(_catalog_root, category)
+    try:
+        scanned, _ = _scan_directory(directory)
+    except OSError:
+        with _catalog_lock:
+            _remove_category(category)
+        return
+    _apply_scan(category, scanned)
+
+
+def rescan_catalog():
+    """全量扫描外部存储目录，和索引对比后只更新变化的条目"""
+    _ensure_started()
+    try:
+        root_files, categories = _scan_directory(_catalog_root)
+    except OSError:
+        return
+    _apply_scan(ROOT_CATEGORY, root_files)
+    for category in categories:
+        refresh_category(category)
+    with _catalog_lock:
+        for category in set(_catalog) - set(categories) - {ROOT_CATEGORY}:
+            _remove_category(category)
+
+
+def refresh_file(path):
+    """页面写入、删除或重命名文件后调用，立即更新该文件的索引，不必等待监视事件"""
+    _ensure_started()
+    location = _split_path(path)
+    if location is None:
+        return
+    category, name = location
+    try:
+        stat = os.stat(path)
+    except OSError:
+        stat = None
+
+    if stat is not None and os.path.isdir(path):
+        # 新建或移入的分类目录，目录下可能已经有文件，整体扫描一次
+        if category == ROOT_CATEGORY:
+            refresh_category(name)
+        return
+
+    with _catalog_lock:
+        if stat is None:
+            _set_entry(category, name, None)
+            # 根目录下被删除的也可能是分类目录
+            if category == ROOT_CATEGORY:
+                _remove_category(name)
+        else:
+            _set_entry(
+                category, name, _make_entry(category, name, stat.st_size, stat.st_mtime)
+            )
+
+
+# ---------- 读取索引 ----------
+
+
+def list_categories():
+    """返回所有分类名（外部存储下的子目录），按名称排序"""
+    global _sorted_categories
+    _ensure_started()
+    with _catalog_lock:
+        if _sorted_categories is None:
+            _sorted_categories = sorted(c for c in _catalog if c != ROOT_CATEGORY)
+        return _sorted_categories
+
+
+def category_exists(category):
+    _ensure_started()
+    with _catalog_lock:
+        return category in _catalog
+
+
+def list_files(category=ROOT_CATEGORY):
+    """返回分类下的文件条目列表，已按中文排序键排好序；返回的列表不要修改"""
+    _ensure_started()
+    with _catalog_lock:
+        files = _sorted_files.get(category)
+        if files is None:
+            files = sorted(
+                _catalog.get(category, {}).values(), key=lambda entry: entry.sort_key
+            )
+            _sorted_files[category] = files
+        return files
+
+
+def get_file(category, name):
+    """按分类和文件名查找文件条目，不存在时返回None"""
+    _ensure_started()
+    with _catalog_lock:
+        return _catalog.get(category, {}).get(name)
+
+
+# ---------- 持久化 ----------
+
+
+def _load_persisted():
+    """从SQLite读取上次保存的索引，返回是否有数据"""
+    engine = get_engine()
+    StorageFile.__table__.create(engine, checkfirst=True)
+    with engine.connect() as conn:
+        rows = conn.execute(
+            select(
+                StorageFile.category,
+                StorageFile.name,
+                StorageFile.size,
+                StorageFile.mtime,
+            )
+        ).fetchall()
+    with _catalog_lock:
+        for category, name, size, mtime in rows:
+            files = _catalog.setdefault(category, {})
+            if name:
+                files[name] = _make_entry(category, name, size, mtime)
+    return bool(rows)
+
+
+def flush_catalog():
+    """把内存中变化的条目写回SQLite"""
+    with _catalog_lock:
+        if not _dirty:
+            return
+        changes = dict(_dirty)
+        _dirty.clear()
+
+    upserts = [
+        {"category": c, "name": n, "size": e.size, "mtime": e.mtime}
+        for (c, n), e in changes.items()
+        if e is not None
+    ]
+    deletes = [key for key, e in changes.items() if e is None]
+    table = StorageFile.__table__
+    try:
+        with get_engine().begin() as conn:
+            if upserts:
+                stmt = sqlite_insert(table)
+                conn.execute(
+                    stmt.on_conflict_do_update(
+                        index_elements=["category", "name"],
+                        set_={"size": stmt.excluded.size, "mtime": stmt.excluded.mtime},
+                    ),
+                    upserts,
+                )
+            for category, name in deletes:
+                conn.execute(
+                    delete(table).where(
+                        (table.c.category == category) & (table.c.name == name)
+                    )
+                )
+    except Exception:
+        # 写入失败时放回待写队列，下次再试（期间又有新变化的以新变化为准）
+        with _catalog_lock:
+            for key, entry in changes.items():
+                _dirty.setdefault(key, entry)
+
+
+def _background_loop():
+    last_rescan = time.monotonic()
+    while not _stop_event.wait(CATALOG_FLUSH_INTERVAL):
+        if time.monotonic() - last_rescan >= CATALOG_RESCAN_INTERVAL:
+            rescan_catalog()
+            last_rescan = time.monotonic()
+        flush_catalog()
+
+
+# ---------- 监视文件变化 ----------
+
+
+class _CatalogEventHandler(FileSystemEventHandler):
+    """把watchdog事件转换为索引的增量更新"""
+
+    def on_created(self, event):
+        refresh_file(event.src_path)
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            refresh_file(event.src_path)
+
+    def on_closed(self, event):
+        refresh_file(event.src_path)
+
+    def on_deleted(self, event):
+        refresh_file(event.src_path)
+
+    def on_moved(self, event):
+        refresh_file(event.src_path)
+        refresh_file(event.dest_path)
+
+
+def _start_observer(root):
+    if Observer is None:
+        return None
+    if CATALOG_POLLING:
+        observer = PollingObserver(timeout=CATALOG_POLL_INTERVAL)
+    else:
+        observer = Observer()
+    # 只需要根目录和分类目录两层，但子目录的事件也要收到
+    observer.schedule(_CatalogEventHandler(), root, recursive=True)
+    observer.daemon = True
+    observer.start()
+    return observer
+
+
+def _ensure_started():
+    if not _catalog_ready:
+        start_catalog()
+
+
+def start_catalog(root=EXTERNAL_STORAGE_PATH):
+    """启动文件索引：读取持久化的索引并开始监视，重复调用不会重复启动
+
+    索引加载完成前其他会话的读取会等待，不会看到空的分类列表。
+    """
+    global _catalog_root, _catalog_ready, _observer
+    with _start_lock:
+        # 启动过程中的扫描也会调用这里，_catalog_root已设置时直接返回
+        if _catalog_root is not None:
+            return
+        _catalog_root = root
+        _stop_event.clear()
+        try:
+            os.makedirs(root, exist_ok=True)
+            if _load_persisted():
+                # 先使用上次保存的索引，后台再全量扫描补上停机期间的变化
+                threading.Thread(
+                    target=rescan_catalog, name="catalog-rescan", daemon=True
+                ).start()
+            else:
+                rescan_catalog()
+            _observer = _start_observer(root)
+        except BaseException:
+            _catalog_root = None
+            raise
+        threading.Thread(
+            target=_background_loop, name="catalog-flush", daemon=True
+        ).start()
+        _catalog_ready = True
+
+
+def stop_catalog():
+    """停止监视并写回未保存的变化"""
+    global _catalog_root, _catalog_ready, _observer, _sorted_categories
+    _catalog_ready = False
+    _stop_event.set()
+    if _observer is not None:
+        _observer.stop()
+        _observer.join()
+        _observer = None
+    flush_catalog()
+    with _catalog_lock:
+        _catalog.clear()
+        _sorted_files.clear()
+        _sorted_categories = None
+        _catalog_root = None
@@ -0,0 +1,161 @@
+import hashlib
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageOps, features
+
+
+# 文件列表中图片的缩略图缓存：按(文件路径, 修改时间)生成小尺寸预览图保存在磁盘上，
+# 总大小超过上限时删除最久未使用的缩略图。缩略图在后台线程池中生成，
+# 上传时预先生成，或在第一次查看分类时生成。
+# 缩略图放在Streamlit的静态文件目录中（.streamlit/config.toml已开启enableStaticServing），
+# 表格里只保存地址，浏览器只会请求当前页实际显示的那些缩略图。
+
+THUMBNAIL_CACHE_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "static", "thumbnails"
+)
+THUMBNAIL_URL_PREFIX = "/app/static/thumbnails/"
+
+# 缓存目录的总大小上限（字节）
+THUMBNAIL_CACHE_BYTES = int(os.getenv("THUMBNAIL_CACHE_BYTES", str(64 * 1024 * 1024)))
+
+# 缩略图最大宽高（像素）和编码质量
+THUMBNAIL_SIZE = (64, 64)
+THUMBNAIL_QUALITY = 60
+
+# 生成缩略图的后台线程数
+THUMBNAIL_WORKERS = 2
+
+# 可以生成缩略图的图片格式
+IMAGE_EXTENSIONS = frozenset([".jpg", ".jpeg", ".png", ".gif", ".webp", ".bmp"])
+
+# Pillow编译时没有WebP支持时改用JPEG
+THUMBNAIL_FORMAT = "WEBP" if features.check("webp") else "JPEG"
+
+
+# 缩略图文件名 -> 文件大小，按最近使用顺序排列（重启后按生成时间恢复）
+_index = None
+_index_bytes = 0
+# 正在生成的缩略图：文件名 -> Future
+_pending = {}
+# 无法生成缩略图的(路径, 修改时间)，不再重复尝试
+_failed = set()
+_lock = threading.Lock()
+_executor = None
+
+
+def is_image(file_name):
+    return os.path.splitext(file_name)[1].lower() in IMAGE_EXTENSIONS
+
+
+def _thumbnail_name(path, mtime):
+    digest = hashlib.sha1(f"{path}\0{mtime}".encode("utf-8")).hexdigest()
+    return f"{digest}.{THUMBNAIL_FORMAT.lower()}"
+
+
+def _load_index():
+    """在锁内调用，第一次使用时读取缓存目录，按修改时间恢复使用顺序"""
+    global _index, _index_bytes
+    if _index is not None:
+        return
+    os.makedirs(THUMBNAIL_CACHE_DIR, exist_ok=True)
+    entries = []
+    with os.scandir(THUMBNAIL_CACHE_DIR) as it:
+        for entry in it:
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name, stat.st_size))
+    entries.sort()
+    _index = OrderedDict((name, size) for _, name, size in entries)
+    _index_bytes = sum(_index.values())
+
+
+def _evict():
+    """在锁内调用，删除最久未使用的缩略图直到总大小不超过上限"""
+    while _index_bytes > THUMBNAIL_CACHE_BYTES and len(_index) > 1:
+        name = next(iter(_index))
+        _remove_from_index(name)
+        try:
+            os.unlink(os.path.join(THUMBNAIL_CACHE_DIR, name))
+        except OSError:
+            pass
+
+
+def _remove_from_index(name):
+    global _index_bytes
+    _index_bytes -= _index.pop(name, 0)
+
+
+def _generate(path, mtime, name):
+    global _index_bytes
+    thumbnail_path = os.path.join(THUMBNAIL_CACHE_DIR, name)
+    temp_path = f"{thumbnail_path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with Image.open(path) as image:
+            # JPEG可以直接按较小的尺寸解码，不必解出整张大图
+            image.draft("RGB", THUMBNAIL_SIZE)
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail(THUMBNAIL_SIZE)
+            if THUMBNAIL_FORMAT == "JPEG" or image.mode not in ("RGB", "RGBA"):
+                image = image.convert("RGB" if THUMBNAIL_FORMAT == "JPEG" else "RGBA")
+            image.save(temp_path, THUMBNAIL_FORMAT, quality=THUMBNAIL_QUALITY)
+        os.replace(temp_path, thumbnail_path)
+        size = os.path.getsize(thumbnail_path)
+    except Exception:
+        # 损坏的图片、超大图片或生成过程中被删除的文件
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        with _lock:
+            _failed.add((path, mtime))
+            _pending.pop(name, None)
+        return
+
+    with _lock:
+        _remove_from_index(name)
+        _index[name] = size
+        _index_bytes += size
+        _pending.pop(name, None)
+        _evict()
+
+
+def request_thumbnail(path, mtime):
+    """在后台生成缩略图，已缓存或正在生成时不重复生成"""
+    global _executor
+    if not is_image(path):
+        return
+    name = _thumbnail_name(path, mtime)
+    with _lock:
+        _load_index()
+        if name in _index or name in _pending or (path, mtime) in _failed:
+            return
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=THUMBNAIL_WORKERS, thread_name_prefix="thumbnail"
+            )
+        _pending[name] = _executor.submit(_generate, path, mtime, name)
+
+
+def get_thumbnails(files):
+    """返回{路径: 缩略图地址}，files为(路径, 修改时间)列表
+
+    只返回已经生成的缩略图，不等待；没有缓存的提交到后台生成，下次显示文件列表时出现。
+    """
+    thumbnails = {}
+    missing = []
+    with _lock:
+        _load_index()
+        for path, mtime in files:
+            if not is_image(path):
+                continue
+            name = _thumbnail_name(path, mtime)
+            if name in _index:
+                _index.move_to_end(name)
+                thumbnails[path] = THUMBNAIL_URL_PREFIX + name
+            else:
+                missing.append((path, mtime))
+    for path, mtime in missing:
+        request_thumbnail(path, mtime)
+    return thumbnails
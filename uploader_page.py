@@ -1,19 +1,51 @@
 import streamlit as st
 import os
 import shutil
-from pathlib import Path
 import pandas as pd
 from datetime import datetime
 import time  # 添加time模块导入
-from utils import chinese_sort_key  # 添加utils模块导入
+from storage_catalog import (
+    EXTERNAL_STORAGE_PATH,
+    list_categories,
+    list_files,
+    refresh_category,
+    refresh_file,
+)
+from blob_store import remove_file, save_upload
+from file_operator import build_zip
+from thumbnail_cache import THUMBNAIL_SIZE, get_thumbnails, request_thumbnail
 from st_aggrid import AgGrid, DataReturnMode, GridUpdateMode, GridOptionsBuilder, JsCode
-import zipfile
-import io
 import base64
 
 
-# 外部存储路径（从环境变量获取或使用默认路径）
-EXTERNAL_STORAGE_PATH = os.getenv("EXTERNAL_STORAGE_PATH", "/external_storage")
+# 文件列表中显示缩略图
+cellRenderer_thumbnail = JsCode(
+    """
+    class ThumbnailRenderer {
+        init(params) {
+            this.eGui = document.createElement('span');
+            if (params.value) {
+                const img = document.createElement('img');
+                img.src = params.value;
+                img.loading = 'lazy';
+                img.style.maxHeight = '100%';
+                img.style.maxWidth = '100%';
+                this.eGui.appendChild(img);
+            }
+        }
+        getGui() {
+            return this.eGui;
+        }
+    };
+    """
+)
+
+
+# 读取打包好的ZIP文件；不缓存内容，否则压缩包会一直占用内存，
+# 相同的文件再次打包时build_zip直接返回已有的ZIP文件，只需重新读取
+def read_zip(zip_path):
+    with open(zip_path, "rb") as f:
+        return f.read()
 
 
 def show_file_upload_page():
@@ -41,12 +73,8 @@ def show_file_list():
     """
     st.subheader("📋 文件列表")
 
-    # 获取所有分类
-    categories = [
-        d
-        for d in os.listdir(EXTERNAL_STORAGE_PATH)
-        if os.path.isdir(os.path.join(EXTERNAL_STORAGE_PATH, d))
-    ]
+    # 从文件索引获取所有分类，不再每次重跑都扫描目录
+    categories = list_categories()
 
     if not categories:
         st.info("暂无文件分类，请先上传文件。")
@@ -54,33 +82,27 @@ def show_file_list():
 
     # 选择分类查看
     selected_category = st.selectbox("选择分类查看", categories)
-    category_path = os.path.join(EXTERNAL_STORAGE_PATH, selected_category)
-
-    # 获取文件列表
-    files = []
-    if os.path.exists(category_path):
-        for file in os.listdir(category_path):
-            file_path = os.path.join(category_path, file)
-            if os.path.isfile(file_path):
-                file_stat = os.stat(file_path)
-                file_ext = Path(file_path).suffix.lower()
-                files.append(
-                    {
-                        "文件名": file,
-                        "大小": file_stat.st_size,  # 保持原始大小用于排序
-                        "格式化大小": format_file_size(file_stat.st_size),
-                        "修改时间": datetime.fromtimestamp(file_stat.st_mtime).strftime(
-                            "%Y-%m-%d %H:%M:%S"
-                        ),
-                        "分类": selected_category,
-                        "路径": file_path,
-                    }
-                )
 
-    # 使用chinese_sort_key对文件列表进行排序
-    if files:
-        files.sort(key=lambda x: chinese_sort_key(x["文件名"]))
+    # 从文件索引获取文件列表，已按chinese_sort_key排好序
+    entries = list_files(selected_category)
+    # 图片只显示已生成的缩略图地址，没有缓存的在后台生成，不必下载原图查看
+    thumbnails = get_thumbnails([(entry.path, entry.mtime) for entry in entries])
+    files = [
+        {
+            "文件名": entry.name,
+            "预览": thumbnails.get(entry.path, ""),
+            "大小": entry.size,  # 保持原始大小用于排序
+            "格式化大小": format_file_size(entry.size),
+            "修改时间": datetime.fromtimestamp(entry.mtime).strftime(
+                "%Y-%m-%d %H:%M:%S"
+            ),
+            "分类": selected_category,
+            "路径": entry.path,
+        }
+        for entry in entries
+    ]
 
+    if files:
         # 转换为DataFrame用于aggrid显示
         df = pd.DataFrame(files)
 
@@ -90,6 +112,16 @@ def show_file_list():
 
         # 配置列
         gb.configure_column("文件名", width=400)
+        gb.configure_column(
+            "预览",
+            width=THUMBNAIL_SIZE[0] + 24,
+            cellRenderer=cellRenderer_thumbnail,
+            sortable=False,
+            filterable=False,
+            hide=not thumbnails,
+        )
+        if thumbnails:
+            gb.configure_grid_options(rowHeight=THUMBNAIL_SIZE[1] + 8)
         gb.configure_column("大小", hide=True)  # 隐藏原始大小列
         gb.configure_column("格式化大小", header_name="大小", width=120)
         gb.configure_column("修改时间", width=200)
@@ -127,26 +159,26 @@ def show_file_list():
             with st.sidebar:
                 st.write(f"已选择 {len(selected_rows)} 个文件")
 
-                # 批量下载按钮
-                # 创建ZIP文件
-                zip_buffer = io.BytesIO()
-                with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
-                    for row in selected_rows:
-                        file_path = row["路径"]
-                        file_name = row["文件名"]
-                        # 将文件添加到ZIP中
-                        zip_file.write(file_path, file_name)
-
-                # 准备下载
-                zip_buffer.seek(0)
-                # 直接提供下载按钮
-                st.download_button(
-                    label="📥 下载选中文件",
-                    data=zip_buffer,
-                    file_name=f"{selected_category}_选中文件.zip",
-                    mime="application/zip",
-                    key="batch_download_sidebar",
-                )
+                # 批量下载：点击后才打包，选中的文件不变时复用上次生成的ZIP文件
+                zip_files = [(row["路径"], row["文件名"]) for row in selected_rows]
+                if st.session_state.get("zip_request") != zip_files:
+                    if st.button("📦 打包选中文件", key="batch_zip_sidebar"):
+                        st.session_state.zip_request = zip_files
+                        st.experimental_rerun()
+                else:
+                    try:
+                        with st.spinner("正在打包..."):
+                            zip_path = build_zip(zip_files)
+                        st.download_button(
+                            label="📥 下载选中文件",
+                            data=read_zip(zip_path),
+                            file_name=f"{selected_category}_选中文件.zip",
+                            mime="application/zip",
+                            key="batch_download_sidebar",
+                        )
+                    except OSError as e:
+                        st.session_state.zip_request = None
+                        st.error(f"❌ 打包失败: {e}")
 
                 # 批量删除按钮
                 if st.button("🗑️ 删除选中文件", key="batch_delete_sidebar"):
@@ -156,7 +188,8 @@ def show_file_list():
                         file_path = row["路径"]
                         file_name = row["文件名"]
                         try:
-                            os.remove(file_path)
+                            remove_file(file_path)
+                            refresh_file(file_path)
                             deleted_count += 1
                         except Exception as e:
                             st.error(f"❌ 删除失败 {file_name}: {e}")
@@ -220,12 +253,8 @@ def show_upload_section():
     """
     st.subheader("📤 上传文件")
 
-    # 获取现有分类
-    categories = [
-        d
-        for d in os.listdir(EXTERNAL_STORAGE_PATH)
-        if os.path.isdir(os.path.join(EXTERNAL_STORAGE_PATH, d))
-    ]
+    # 从文件索引获取现有分类
+    categories = list_categories()
 
     # 选择或创建分类
     if categories:
@@ -242,7 +271,9 @@ def show_upload_section():
 
     if selected_category:
         category_path = os.path.join(EXTERNAL_STORAGE_PATH, selected_category)
-        os.makedirs(category_path, exist_ok=True)
+        if selected_category not in categories:
+            os.makedirs(category_path, exist_ok=True)
+            refresh_category(selected_category)
 
         # 文件上传
         uploaded_files = st.file_uploader(
@@ -250,17 +281,41 @@ def show_upload_section():
         )
 
         if uploaded_files:
+            # 本会话已保存过的上传文件，重跑时直接跳过
+            if "saved_uploads" not in st.session_state:
+                st.session_state.saved_uploads = set()
+
             success_count = 0
+            skipped_count = 0
             for uploaded_file in uploaded_files:
+                file_path = os.path.join(category_path, uploaded_file.name)
+                upload_key = (
+                    file_path,
+                    getattr(uploaded_file, "file_id", None),
+                    uploaded_file.size,
+                )
+                if upload_key in st.session_state.saved_uploads:
+                    continue
                 try:
-                    # 保存文件
-                    file_path = os.path.join(category_path, uploaded_file.name)
-                    with open(file_path, "wb") as f:
-                        f.write(uploaded_file.getbuffer())
-                    success_count += 1
+                    # 分块写入临时文件后原子重命名，内容与已有文件相同时不写入；
+                    # 开启去重存储时已保存过的内容只建立硬链接
+                    written, _ = save_upload(
+                        uploaded_file, file_path, size=uploaded_file.size
+                    )
+                    st.session_state.saved_uploads.add(upload_key)
+                    if written:
+                        refresh_file(file_path)
+                        # 提前在后台生成缩略图，查看文件列表时直接显示
+                        request_thumbnail(file_path, os.stat(file_path).st_mtime)
+                        success_count += 1
+                    else:
+                        skipped_count += 1
                 except Exception as e:
                     st.error(f"❌ 上传失败 {uploaded_file.name}: {e}")
 
+            if skipped_count > 0:
+                st.info(f"ℹ️ {skipped_count} 个文件与已有文件内容相同，已跳过")
+
             if success_count > 0:
                 st.success(f"🎉 成功上传 {success_count} 个文件！")
                 # 更新刷新键以强制重新加载表格
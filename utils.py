@@ -1,18 +1,48 @@
+import multiprocessing
+import os
 import re
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 
 
+try:
+    from pypinyin import pinyin, Style
+except ImportError:
+    # 没有安装pypinyin时，非数字部分按小写后的Unicode编码排序
+    pinyin = None
+
+# 文件名中的数字部分
+_DIGITS_PATTERN = re.compile(r"(\d+)")
+
+# 单个字符 -> 小写拼音（非汉字为小写的字符本身），第一次遇到时查询pypinyin后常驻内存
+_PINYIN_TABLE = {}
+
+
+def _char_pinyin(char):
+    value = _PINYIN_TABLE.get(char)
+    if value is None:
+        if char.isascii():
+            value = char.lower()
+        else:
+            value = "".join(
+                item[0].lower() for item in pinyin(char, style=Style.NORMAL) if item
+            )
+        _PINYIN_TABLE[char] = value
+    return value
+
+
+@lru_cache(maxsize=16384)
 def chinese_sort_key(filename):
     """
     为中文文件名生成排序键，支持数字自然排序和汉字拼音排序
-    """
-    import os
-    import re
 
+    汉字按单字查表转换为拼音，整个排序键按文件名缓存（LRU）。
+    """
     # 移除文件扩展名，获取完整的文件名（不含扩展名）
     name_without_ext = os.path.splitext(filename)[0]
 
     # 使用正则表达式将文件名分割为数字和非数字部分
-    parts = re.split(r"(\d+)", name_without_ext)
+    parts = _DIGITS_PATTERN.split(name_without_ext)
 
     # 处理每个部分，将数字转换为数值，非数字部分进行拼音转换
     sort_key = []
@@ -20,25 +50,117 @@ def chinese_sort_key(filename):
         if part.isdigit():
             # 数字部分转换为整数，确保数值比较（1 < 2 < 10）
             sort_key.append(int(part))
+        elif pinyin is None:
+            sort_key.append(part.lower())
         else:
-            # 非数字部分进行拼音转换
-            try:
-                from pypinyin import pinyin, Style
-
-                pinyin_list = []
-                for item in pinyin(part, style=Style.NORMAL):
-                    if item:
-                        pinyin_list.append(item[0].lower())
-                # 将拼音列表转换为字符串，确保可比较
-                sort_key.append("".join(pinyin_list))
-            except ImportError:
-                # 如果没有安装pypinyin，使用Unicode编码进行简单排序
-                sort_key.append(part.lower())
+            # 非数字部分逐字转换为拼音并拼接成字符串，确保可比较
+            sort_key.append("".join(map(_char_pinyin, part)))
 
     # 返回一个元组，确保所有元素都是可比较的类型
     return tuple(sort_key)
 
 
+# 重定向符号：> >> >| >& < << <> &> &>> 2> 2>> 等（分支顺序决定同一位置的匹配结果）
+_REDIRECTION_PATTERN = re.compile(
+    r"\||[0-9]*&?>[&|]?|[0-9]*<[<]?|[0-9]*>>|<<-|<>|[0-9]*>\("
+)
+
+# 完整的重定向符号词元
+_REDIRECTION_TOKEN_PATTERN = re.compile(
+    r"(?:\||[0-9]*&?>[&|]?|[0-9]*<[<]?|[0-9]*>>|<<-|<>|[0-9]*>\()"
+)
+
+# 可能作为重定向符号开头的字符
+_REDIRECTION_START_CHARS = frozenset("0123456789|&<>")
+
+# 引号字符
+_QUOTE_CHARS = ("'", '"')
+
+
+def _tokenize_command(command_str):
+    """
+    单遍扫描命令字符串，返回[(词元, 是否为重定向符号)]
+
+    1. 成对引号内的内容原样保留，不拆出重定向符号（引号内的空白仍然分隔词元，
+       被空白隔开的片段本身是重定向符号时仍按重定向符号处理）
+    2. 重定向符号单独成为一个词元
+    3. 其余内容按空白分隔
+    """
+    tokens = []
+    buffer = []
+    # 当前词元是否包含引号内的内容
+    quoted = False
+    # 记录某种引号之后已经没有配对的引号，避免重复查找
+    unmatched_quotes = set()
+    length = len(command_str)
+    pos = 0
+
+    def flush():
+        nonlocal quoted
+        if buffer:
+            token = "".join(buffer)
+            is_redirection = quoted and bool(
+                _REDIRECTION_TOKEN_PATTERN.fullmatch(token)
+            )
+            tokens.append((token, is_redirection))
+            buffer.clear()
+        quoted = False
+
+    while pos < length:
+        char = command_str[pos]
+
+        # 成对引号：内容原样保留，其中的空白仍然分隔词元
+        if char in _QUOTE_CHARS and char not in unmatched_quotes:
+            end = command_str.find(char, pos + 1)
+            if end == -1:
+                unmatched_quotes.add(char)
+            else:
+                for quoted_char in command_str[pos : end + 1]:
+                    if quoted_char.isspace():
+                        flush()
+                    else:
+                        buffer.append(quoted_char)
+                        quoted = True
+                pos = end + 1
+                continue
+
+        # 重定向符号
+        if char in _REDIRECTION_START_CHARS:
+            match = _REDIRECTION_PATTERN.match(command_str, pos)
+            if match:
+                flush()
+                tokens.append((match.group(0), True))
+                pos = match.end()
+                continue
+
+        # 空白分隔词元
+        if char.isspace():
+            flush()
+        else:
+            buffer.append(char)
+        pos += 1
+
+    flush()
+    return tokens
+
+
+# 排序函数
+def _sort_plus(opt):
+    num = opt[1:]
+    return (0, int(num)) if num.isdigit() else (1, num.lower())
+
+
+def _sort_letter(opt):
+    char = opt[1]
+    return (0, char) if char.islower() else (1, char)
+
+
+def _sort_digit(opt):
+    num_part = opt[1:]
+    return int(num_part) if num_part.isdigit() else float("inf")
+
+
+@lru_cache(maxsize=4096)
 def normalize_command(cmd):
     """
     最终优化的命令参数归一化函数
@@ -51,51 +173,21 @@ def normalize_command(cmd):
     5. 数字选项（-10）保持整体并按数值排序
     6. 智能处理混合选项（如 -6v → -v -6）
 
+    命令只扫描一遍完成分词，结果按原始字符串缓存（LRU）。
+
     参数:
     cmd (str): 原始命令字符串
 
     返回:
     str: 归一化后的命令字符串
     """
-
-    def normalize_redirections(command_str):
-        """智能处理重定向符号，确保前后有空格，同时保护引号内的内容"""
-        # 保护引号内的内容不被修改
-        protected = []
-
-        def protect_quotes(match):
-            token = match.group(0)
-            key = f"__PROTECTED_{len(protected)}__"
-            protected.append((key, token))
-            return key
-
-        # 使用临时令牌替换引号内的内容
-        quoted_str = re.sub(r"(\'[^\']*\'|\"[^\"]*\")", protect_quotes, command_str)
-
-        # 处理重定向符号（确保前后有空格）
-        # 匹配所有重定向符号：> >> >| >& < << <> &> &>> 2> 2>> 等
-        redir_pattern = r"(\||[0-9]*&?>[&|]?|[0-9]*<[<]?|[0-9]*>>|<<-|<>|[0-9]*>\()"
-        spaced = re.sub(redir_pattern, r" \1 ", quoted_str)
-
-        # 清理多余空格
-        cleaned = re.sub(r"\s+", " ", spaced).strip()
-
-        # 恢复被保护的内容
-        for key, token in protected:
-            cleaned = cleaned.replace(key, token)
-
-        return cleaned
-
-    # 预处理：智能处理重定向符号
-    cmd = normalize_redirections(cmd.strip())
-
     # 分割命令为多个部分
-    parts = cmd.split()
-    if not parts:
-        return cmd
+    tokens = _tokenize_command(cmd)
+    if not tokens:
+        return ""
 
     # 初始化分类容器
-    cmd_name = parts[0]
+    cmd_name = tokens[0][0]
     plus_opts = []
     minus_letters = []
     minus_digits = []
@@ -105,25 +197,16 @@ def normalize_command(cmd):
 
     # 分类处理各个部分
     i = 1
-    while i < len(parts):
-        part = parts[i]
-
-        # 处理重定向符号及后续参数
-        if re.match(
-            r"^(\||[0-9]*&?>[&|]?|[0-9]*<[<]?|[0-9]*>>|<<-|<>|[0-9]*>\()$", part
-        ):
-            # 保存重定向符号
-            redirection = part
-
-            # 获取重定向目标（下一个参数）
-            if i + 1 < len(parts):
-                target = parts[i + 1]
-                # 添加到重定向列表
-                redirections.append(redirection)
-                redirections.append(target)
-                # 跳过下一个参数（目标）
-                i += 2
-                continue
+    while i < len(tokens):
+        part, is_redirection = tokens[i]
+
+        # 处理重定向符号及后续参数（重定向目标为下一个参数）
+        if is_redirection and i + 1 < len(tokens):
+            redirections.append(part)
+            redirections.append(tokens[i + 1][0])
+            # 跳过下一个参数（目标）
+            i += 2
+            continue
 
         # 处理 + 号选项
         if part.startswith("+") and len(part) > 1:
@@ -133,31 +216,28 @@ def normalize_command(cmd):
         elif part.startswith("--") and len(part) > 2:
             long_opts.append(part)
 
-        # 处理 - 开头的选项
+        # 处理 - 开头的选项，一次遍历区分字母和数字
         elif part.startswith("-") and len(part) > 1:
+            letters = []
+            digits = []
+            for c in part[1:]:
+                if c.isalpha():
+                    letters.append(c)
+                elif c.isdigit():
+                    digits.append(c)
+
             # 纯数字选项
-            if part[1:].isdigit():
+            if len(digits) == len(part) - 1:
                 minus_digits.append(part)
 
-            # 混合选项（字母+数字）
-            elif any(c.isalpha() for c in part[1:]) and any(
-                c.isdigit() for c in part[1:]
-            ):
-                # 分离字母和数字
-                letters = "".join(c for c in part[1:] if c.isalpha())
-                digits = "".join(c for c in part[1:] if c.isdigit())
-
-                # 添加分离后的选项
-                if letters:
-                    for c in letters:
-                        minus_letters.append(f"-{c}")
-                if digits:
-                    minus_digits.append(f"-{digits}")
+            # 混合选项（字母+数字），分离字母和数字，其他字符丢弃
+            elif letters and digits:
+                minus_letters.extend(f"-{c}" for c in letters)
+                minus_digits.append(f"-{''.join(digits)}")
 
             # 纯字母选项
-            elif part[1:].isalpha():
-                for c in part[1:]:
-                    minus_letters.append(f"-{c}")
+            elif len(letters) == len(part) - 1:
+                minus_letters.extend(f"-{c}" for c in letters)
 
             # 其他特殊选项
             else:
@@ -169,23 +249,10 @@ def normalize_command(cmd):
 
         i += 1
 
-    # 排序函数
-    def sort_plus(opt):
-        num = opt[1:]
-        return (0, int(num)) if num.isdigit() else (1, num.lower())
-
-    def sort_letter(opt):
-        char = opt[1]
-        return (0, char) if char.islower() else (1, char)
-
-    def sort_digit(opt):
-        num_part = opt[1:]
-        return int(num_part) if num_part.isdigit() else float("inf")
-
     # 执行排序
-    plus_opts.sort(key=sort_plus)
-    minus_letters.sort(key=sort_letter)
-    minus_digits.sort(key=sort_digit)
+    plus_opts.sort(key=_sort_plus)
+    minus_letters.sort(key=_sort_letter)
+    minus_digits.sort(key=_sort_digit)
 
     # 构建最终命令
     normalized = [cmd_name]
@@ -199,6 +266,49 @@ def normalize_command(cmd):
     return " ".join(normalized)
 
 
+# 去重后的命令数不少于这个数量时，才值得分发到多个进程
+NORMALIZE_PARALLEL_THRESHOLD = 20000
+
+
+def normalize_commands(commands, max_workers=None):
+    """
+    批量归一化命令，结果顺序与输入一致
+
+    同一批中相同的字符串只归一化一次（同一个班的学生大多数答案相同）。
+    去重后数量达到NORMALIZE_PARALLEL_THRESHOLD时分发到进程池；
+    max_workers为1时始终在当前进程中计算。
+
+    参数:
+    commands (iterable): 原始命令字符串
+    max_workers (int): 进程数，默认为CPU核数
+
+    返回:
+    list: 归一化后的命令字符串列表
+    """
+    commands = list(commands)
+    distinct = list(dict.fromkeys(commands))
+    max_workers = max_workers or os.cpu_count() or 1
+
+    if max_workers > 1 and len(distinct) >= NORMALIZE_PARALLEL_THRESHOLD:
+        # 可能在多线程的服务进程中调用，用forkserver（不支持时用spawn）启动子进程，
+        # 避免fork复制到被其他线程持有的锁
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context(
+            "forkserver" if "forkserver" in methods else "spawn"
+        )
+        with ProcessPoolExecutor(
+            max_workers=max_workers, mp_context=context
+        ) as executor:
+            # 分块提交，减少进程间通信次数
+            chunksize = max(len(distinct) // (max_workers * 4), 1)
+            results = executor.map(normalize_command, distinct, chunksize=chunksize)
+            normalized = dict(zip(distinct, results))
+    else:
+        normalized = {cmd: normalize_command(cmd) for cmd in distinct}
+
+    return [normalized[cmd] for cmd in commands]
+
+
 if __name__ == "__main__":
     # 增强的测试用例
     test_cases = [